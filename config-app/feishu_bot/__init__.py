@@ -4,7 +4,8 @@ from .opencode_client import OpenCodeClient
 from .opencode_processor import OpenCodeProcessor
 from .bot import FeishuBot
 from .cards import make_card, help_card
-from .store import JsonStore, MemoryManager
+from .store import JsonStore, MemoryManager, RetentionPolicy
+from .sqlite_store import SqliteStore, migrate_json_store
 
 __all__ = [
     "FeishuConfig",
@@ -16,4 +17,7 @@ __all__ = [
     "help_card",
     "JsonStore",
     "MemoryManager",
+    "RetentionPolicy",
+    "SqliteStore",
+    "migrate_json_store",
 ]
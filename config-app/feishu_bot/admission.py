@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from collections import deque
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class AdmissionController(Generic[T]):
+    """Bound the prompts in flight, globally and per user.
+
+    :meth:`submit` admits an item when both limits have room. Otherwise
+    it queues the item in a FIFO wait queue of at most ``max_waiting``
+    entries, or rejects it when that queue is full. :meth:`release`
+    frees a slot and admits the first waiting items whose user is back
+    under the per-user limit. A limit of 0 means unlimited.
+
+    Not thread-safe; the processor only uses it from its event loop.
+    """
+
+    def __init__(
+        self, max_inflight: int = 32, max_per_user: int = 3, max_waiting: int = 100
+    ) -> None:
+        self._max_inflight = max_inflight
+        self._max_per_user = max_per_user
+        self._max_waiting = max_waiting
+        self._inflight = 0
+        self._per_user: dict[str, int] = {}
+        self._waiting: deque[tuple[str, T]] = deque()
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def waiting(self) -> list[T]:
+        return [item for _, item in self._waiting]
+
+    def submit(self, user: str, item: T) -> int | None:
+        """Return 0 if admitted, the 1-based wait position, or None if shed."""
+        # 有全局空位时，队列中的项都是因个人上限在等待，直接放行不算插队
+        if self._has_room(user):
+            self._take(user)
+            return 0
+        if self._max_waiting and len(self._waiting) >= self._max_waiting:
+            return None
+        self._waiting.append((user, item))
+        return len(self._waiting)
+
+    def release(self, user: str) -> list[T]:
+        """Free one slot held by *user*; return the items admitted in its place."""
+        self._inflight = max(0, self._inflight - 1)
+        left = self._per_user.get(user, 0) - 1
+        if left > 0:
+            self._per_user[user] = left
+        else:
+            self._per_user.pop(user, None)
+
+        admitted: list[T] = []
+        skipped: list[tuple[str, T]] = []
+        # 跳过已达个人上限的用户，保持其余用户的先后顺序
+        while self._waiting and self._has_room(None):
+            waiting_user, item = self._waiting.popleft()
+            if self._has_room(waiting_user):
+                self._take(waiting_user)
+                admitted.append(item)
+            else:
+                skipped.append((waiting_user, item))
+        self._waiting.extendleft(reversed(skipped))
+        return admitted
+
+    def _has_room(self, user: str | None) -> bool:
+        if self._max_inflight and self._inflight >= self._max_inflight:
+            return False
+        if user is None or not self._max_per_user:
+            return True
+        return self._per_user.get(user, 0) < self._max_per_user
+
+    def _take(self, user: str) -> None:
+        self._inflight += 1
+        self._per_user[user] = self._per_user.get(user, 0) + 1
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Benchmark JsonStore snapshot copy/flush/load time per codec.
+
+Usage: python -m feishu_bot.bench_store [--sizes 1000 10000 100000]
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+from .codec import decode_snapshot, get_codec, msgpack, orjson
+from .store import JsonStore
+
+_WORDS = (
+    "部署 数据库 前端 接口 测试 缓存 日志 权限 配置 容器 docker react python "
+    "sqlite redis deploy review refactor migration pipeline feishu opencode"
+).split()
+
+
+def _fill(store: JsonStore, n: int) -> None:
+    rnd = random.Random(42)
+    for i in range(n):
+        words = [rnd.choice(_WORDS) for _ in range(120)]
+        store.set_summary(
+            f"ses_{i:08d}",
+            f"feishu-{i % 500:04d}",
+            " ".join(words),
+            list(dict.fromkeys(words))[:15],
+            f"ou_{i % 500:04d}",
+        )
+    store.flush()
+
+
+def _time(fn) -> float:
+    gc.collect()
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+class _LegacyCodec:
+    """The pre-codec format: ``json.dump(..., indent=2)``."""
+
+    name = "json+indent"
+
+    def encode(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def _write(path: Path, payload: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def run(sizes: list[int]) -> None:
+    codecs: list[Any] = [_LegacyCodec(), get_codec("json")]
+    if orjson is not None:
+        codecs.append(get_codec("orjson"))
+    if msgpack is not None:
+        codecs.append(get_codec("msgpack"))
+    print(
+        f"{'summaries':>10} {'codec':>12} {'size':>10} "
+        f"{'copy':>9} {'flush':>9} {'load':>9} {'open':>9}"
+    )
+    for n in sizes:
+        tmp = Path(tempfile.mkdtemp(prefix="bench_store_"))
+        try:
+            # 日志模式灌数据，避免每批都重写整个快照
+            seed = JsonStore(
+                str(tmp / "seed"), journal=True, compact_threshold=10**9
+            )
+            try:
+                _fill(seed, n)
+                # copy = 持读锁期间的工作（_snapshot_files），编码与写盘在锁外
+                copy_s = _time(seed._snapshot_files)
+                data = seed._snapshot()
+            finally:
+                seed.close()
+            for codec in codecs:
+                path = tmp / f"store.{codec.name}"
+                # flush = 编码 + 写盘 + fsync（_write_files）；load = 读盘 + 自动识别解码
+                flush_s = _time(lambda: _write(path, codec.encode(data)))
+                load_s = _time(lambda: decode_snapshot(path.read_bytes()))
+                # open = 完整的 JsonStore 启动（含索引重建）
+                open_s = _time(lambda: JsonStore(str(path)).close())
+                print(
+                    f"{n:>10} {codec.name:>12} {path.stat().st_size / 1e6:>8.1f}MB "
+                    f"{copy_s * 1000:>7.0f}ms {flush_s * 1000:>7.0f}ms {load_s * 1000:>7.0f}ms "
+                    f"{open_s * 1000:>7.0f}ms"
+                )
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="JsonStore codec benchmark")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    args = parser.parse_args()
+    run(args.sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -16,7 +16,10 @@ from lark_oapi.api.application.v6 import P2ApplicationBotMenuV6
 from .config import FeishuConfig
 from .feishu_client import FeishuClient
 from .opencode_processor import OpenCodeProcessor
-from .store import JsonStore, MemoryManager
+from .store import JsonStore, MemoryManager, RetentionPolicy, tokenize_text
+from .summarizer import get_summarizer
+from .vector import get_embedder
+from .sqlite_store import SqliteStore, migrate_json_store
 from .cards import (
     help_card,
     session_list_card,
@@ -30,6 +33,7 @@ from .cards import (
     completion_card,
     working_card,
     vcs_card,
+    busy_card,
 )
 
 _STREAM_INTERVAL = 3.0
@@ -39,14 +43,59 @@ class FeishuBot:
     def __init__(self, config: FeishuConfig):
         self.config = config
         self.feishu_client = FeishuClient(config)
-        self.store = JsonStore()
+        self.store = self._open_store()
         self.processor = OpenCodeProcessor(config, store=self.store)
         if self.processor.client:
-            self.memory_manager = MemoryManager(self.store, self.processor.client)
+            # api = 先调用模型总结，失败时退回本地抽取式摘要
+            engine = config.memory_summary_engine
+            self.memory_manager = MemoryManager(
+                self.store,
+                self.processor.client,
+                # SSE 的 session.idle 负责及时总结，定时扫描只做兜底
+                interval=config.memory_sweep_interval,
+                retention=RetentionPolicy(
+                    max_per_user=config.memory_max_per_user,
+                    max_age_days=config.memory_max_age_days,
+                    max_idle_days=config.memory_max_idle_days,
+                ),
+                concurrency=config.memory_concurrency,
+                session_timeout=config.memory_session_timeout,
+                idle_delay=config.memory_idle_delay,
+                summarizer=get_summarizer(
+                    "extractive" if engine == "api" else engine, tokenize_text
+                ),
+                use_api_summary=engine == "api",
+                is_session_active=self.processor.is_session_active,
+            )
+            self.processor.add_idle_listener(self.memory_manager.notify_idle)
         else:
             self.memory_manager = None
         self._handler = self._build_event_handler()
 
+    def _open_store(self) -> Any:
+        # 只有启用语义检索时才加载 embedding 模型
+        embedder = (
+            get_embedder(self.config.memory_embedder)
+            if self.config.memory_retrieval != "keyword"
+            else None
+        )
+        if self.config.store_backend != "sqlite":
+            return JsonStore(
+                journal=self.config.store_journal,
+                durability=self.config.store_durability,
+                flush_interval=self.config.store_flush_interval_ms / 1000.0,
+                codec=self.config.store_codec,
+                shards=self.config.store_shards,
+                embedder=embedder,
+            )
+        store = SqliteStore(embedder=embedder)
+        json_path = store.path.with_name("store.json")
+        # 首次切换到 SQLite 时一次性迁移旧的 store.json
+        if json_path.exists() and not store.get_summarized_session_ids():
+            if not store.get_all_user_sessions():
+                migrate_json_store(str(json_path), store)
+        return store
+
     def _build_event_handler(self) -> lark.EventDispatcherHandler:
         return (
             lark.EventDispatcherHandler.builder("", "")
@@ -639,10 +688,31 @@ class FeishuBot:
             reply_callback=reply_cb,
             progress_callback=progress_cb,
             error_callback=error_cb,
+            queued_callback=self._make_queued_callback(card_msg_id, session_id),
+            rejected_callback=self._make_rejected_callback(card_msg_id, chat_id),
         )
 
+    def _make_queued_callback(self, card_msg_id: str | None, session_id: str):
+        def _on_queued(_message_id: str, position: int) -> None:
+            if card_msg_id:
+                self.feishu_client.update_card(
+                    card_msg_id, thinking_card(session_id, queue_position=position)
+                )
+
+        return _on_queued
+
+    def _make_rejected_callback(self, card_msg_id: str | None, chat_id: str):
+        def _on_rejected(_message_id: str) -> None:
+            if card_msg_id:
+                self.feishu_client.update_card(card_msg_id, busy_card())
+            else:
+                self.feishu_client.send_card(chat_id, busy_card())
+
+        return _on_rejected
+
     def _make_progress_callback(self, card_msg_id: str | None, session_id: str):
         last_update = [0.0]
+        seeded_todos: list[Any] = [None, False]
 
         def _on_progress(_sid: str, partial_text: str) -> None:
             if not card_msg_id:
@@ -652,13 +722,17 @@ class FeishuBot:
                 return
             last_update[0] = now
 
-            todos = None
+            # 优先用 SSE 推送的 todo；尚未推送时只回拉一次作为初值
+            todos = self.processor.get_streamed_todos(_sid)
             client = self.processor.client
-            if client and session_id:
+            if todos is None and not seeded_todos[1] and client and session_id:
+                seeded_todos[1] = True
                 try:
-                    todos = client.get_todos(session_id)
+                    seeded_todos[0] = client.get_todos(session_id)
                 except Exception:
                     pass
+            if todos is None:
+                todos = seeded_todos[0]
 
             if todos:
                 card = working_card(
@@ -712,6 +786,13 @@ class FeishuBot:
         if not self.feishu_client.reply_card(message_id, card):
             self.feishu_client.send_card(chat_id, card)
 
+    def stop(self) -> None:
+        self.processor.stop()
+        if self.memory_manager:
+            self.memory_manager.stop()
+        # 落盘尚在队列中的写入
+        self.store.close()
+
     def start(self) -> None:
         log_level_map = {
             "DEBUG": lark.LogLevel.DEBUG,
@@ -228,7 +228,7 @@ def vcs_card(
     return make_card("🔀 Git 状态", "\n".join(lines), buttons=buttons)
 
 
-def thinking_card(session_id: str = "") -> dict[str, Any]:
+def thinking_card(session_id: str = "", queue_position: int = 0) -> dict[str, Any]:
     buttons = [
         make_button(
             "⏹ 终止",
@@ -238,6 +238,12 @@ def thinking_card(session_id: str = "") -> dict[str, Any]:
             session_id=session_id,
         ),
     ]
+    if queue_position > 0:
+        return make_card(
+            "⏳ 排队中...",
+            f"当前请求较多，你的消息排在第 **{queue_position}** 位，请稍候...",
+            color="blue",
+        )
     return make_card(
         "⚙️ 正在思考中...",
         "请稍候，AI 正在处理你的请求...",
@@ -246,6 +252,14 @@ def thinking_card(session_id: str = "") -> dict[str, Any]:
     )
 
 
+def busy_card() -> dict[str, Any]:
+    return make_card(
+        "🚦 服务繁忙",
+        "当前排队的请求已满，这条消息未被处理。请稍后再发送一次。",
+        color="orange",
+    )
+
+
 def streaming_card(text: str, session_id: str = "") -> dict[str, Any]:
     preview = text[-2000:] if len(text) > 2000 else text
     buttons = [
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+
+    def decode(self, raw: bytes) -> Any:
+        return json.loads(raw.decode("utf-8"))
+
+
+class OrjsonCodec:
+    name = "orjson"
+
+    def encode(self, obj: Any) -> bytes:
+        assert orjson is not None
+        return orjson.dumps(obj)
+
+    def decode(self, raw: bytes) -> Any:
+        assert orjson is not None
+        return orjson.loads(raw)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    def encode(self, obj: Any) -> bytes:
+        assert msgpack is not None
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, raw: bytes) -> Any:
+        assert msgpack is not None
+        return msgpack.unpackb(raw, raw=False)
+
+
+def get_codec(name: str = "auto") -> JsonCodec | OrjsonCodec | MsgpackCodec:
+    """Return the snapshot codec for *name*.
+
+    ``auto`` picks orjson when it is installed and falls back to the stdlib
+    json module otherwise.
+    """
+    name = name.lower()
+    if name == "auto":
+        return OrjsonCodec() if orjson is not None else JsonCodec()
+    if name == "json":
+        return JsonCodec()
+    if name == "orjson":
+        if orjson is None:
+            raise ImportError(
+                "orjson is required for the orjson codec. Install with: pip install orjson"
+            )
+        return OrjsonCodec()
+    if name == "msgpack":
+        if msgpack is None:
+            raise ImportError(
+                "msgpack is required for the msgpack codec. Install with: pip install msgpack"
+            )
+        return MsgpackCodec()
+    raise ValueError(f"unknown codec: {name}")
+
+
+class SnapshotFormatError(ValueError):
+    """The snapshot is neither JSON nor msgpack."""
+
+
+def decode_snapshot(raw: bytes) -> Any:
+    """Decode a snapshot written by any codec.
+
+    JSON snapshots are always objects and start with ``{``; msgpack
+    snapshots start with a map header. Anything else raises
+    :class:`SnapshotFormatError`, and a msgpack snapshot without msgpack
+    installed raises ImportError, so callers never mistake an unreadable
+    store for an empty one.
+    """
+    head = raw[:1]
+    # msgpack 的 map 头：fixmap 0x80-0x8f、map16 0xde、map32 0xdf
+    if head and (0x80 <= head[0] <= 0x8F or head[0] in (0xDE, 0xDF)):
+        return get_codec("msgpack").decode(raw)
+    stripped = raw.lstrip()
+    if stripped and stripped[:1] != b"{":
+        raise SnapshotFormatError(f"unrecognized snapshot format: {head!r}")
+    return get_codec("auto").decode(raw)
@@ -1,6 +1,6 @@
 import os
 from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Optional
 
 
 @dataclass
@@ -15,12 +15,38 @@ class FeishuConfig:
     opencode_server_port: int = 4096
     opencode_server_password: Optional[str] = "test123"
     use_server_mode: bool = True
+    store_journal: bool = True
+    store_backend: str = "json"
+    store_durability: str = "batched"
+    store_flush_interval_ms: int = 200
+    store_codec: str = "auto"
+    store_shards: int = 0
+    memory_top_k: int = 10
+    memory_max_per_user: int = 0
+    memory_max_age_days: float = 0.0
+    memory_max_idle_days: float = 0.0
+    memory_concurrency: int = 4
+    memory_session_timeout: float = 300.0
+    memory_sweep_interval: float = 1800.0
+    memory_idle_delay: float = 60.0
+    memory_summary_engine: str = "api"
+    memory_retrieval: str = "keyword"
+    memory_embedder: str = "hashing"
+    memory_context_tokens: int = 1500
+    memory_min_score: float = 0.2
+    memory_cache_size: int = 256
+    memory_cache_ttl: float = 300.0
+    prompt_coalesce_max: int = 5
+    prompt_max_inflight: int = 32
+    prompt_max_per_user: int = 3
+    prompt_max_waiting: int = 100
 
     @classmethod
-    def from_env(cls) -> "FeishuConfig":
-        return cls(
-            app_id=os.environ["FEISHU_APP_ID"],
-            app_secret=os.environ["FEISHU_APP_SECRET"],
+    def from_env(cls, **overrides: Any) -> "FeishuConfig":
+        """Read every setting from the environment; *overrides* take precedence."""
+        values: dict[str, Any] = dict(
+            app_id=os.environ.get("FEISHU_APP_ID", ""),
+            app_secret=os.environ.get("FEISHU_APP_SECRET", ""),
             opencode_path=os.environ.get("OPENCODE_PATH", "opencode"),
             working_dir=os.environ.get("OPENCODE_WORKING_DIR"),
             model=os.environ.get("OPENCODE_MODEL", "fox-cc/claude-opus-4-6"),
@@ -30,7 +56,53 @@ class FeishuConfig:
             opencode_server_password=os.environ.get("OPENCODE_SERVER_PASSWORD"),
             use_server_mode=os.environ.get("OPENCODE_USE_SERVER", "true").lower()
             in ("true", "1", "yes"),
+            store_journal=os.environ.get("FEISHU_STORE_JOURNAL", "true").lower()
+            in ("true", "1", "yes"),
+            store_backend=os.environ.get("FEISHU_STORE_BACKEND", "json").lower(),
+            store_durability=os.environ.get(
+                "FEISHU_STORE_DURABILITY", "batched"
+            ).lower(),
+            store_flush_interval_ms=int(
+                os.environ.get("FEISHU_STORE_FLUSH_INTERVAL_MS", "200")
+            ),
+            store_codec=os.environ.get("FEISHU_STORE_CODEC", "auto").lower(),
+            store_shards=int(os.environ.get("FEISHU_STORE_SHARDS", "0")),
+            memory_top_k=int(os.environ.get("FEISHU_MEMORY_TOP_K", "10")),
+            memory_max_per_user=int(os.environ.get("FEISHU_MEMORY_MAX_PER_USER", "0")),
+            memory_max_age_days=float(
+                os.environ.get("FEISHU_MEMORY_MAX_AGE_DAYS", "0")
+            ),
+            memory_max_idle_days=float(
+                os.environ.get("FEISHU_MEMORY_MAX_IDLE_DAYS", "0")
+            ),
+            memory_concurrency=int(os.environ.get("FEISHU_MEMORY_CONCURRENCY", "4")),
+            memory_session_timeout=float(
+                os.environ.get("FEISHU_MEMORY_SESSION_TIMEOUT", "300")
+            ),
+            memory_sweep_interval=float(
+                os.environ.get("FEISHU_MEMORY_SWEEP_INTERVAL", "1800")
+            ),
+            memory_idle_delay=float(os.environ.get("FEISHU_MEMORY_IDLE_DELAY", "60")),
+            memory_summary_engine=os.environ.get(
+                "FEISHU_MEMORY_SUMMARY_ENGINE", "api"
+            ).lower(),
+            memory_retrieval=os.environ.get(
+                "FEISHU_MEMORY_RETRIEVAL", "keyword"
+            ).lower(),
+            memory_embedder=os.environ.get("FEISHU_MEMORY_EMBEDDER", "hashing"),
+            memory_context_tokens=int(
+                os.environ.get("FEISHU_MEMORY_CONTEXT_TOKENS", "1500")
+            ),
+            memory_min_score=float(os.environ.get("FEISHU_MEMORY_MIN_SCORE", "0.2")),
+            memory_cache_size=int(os.environ.get("FEISHU_MEMORY_CACHE_SIZE", "256")),
+            memory_cache_ttl=float(os.environ.get("FEISHU_MEMORY_CACHE_TTL", "300")),
+            prompt_coalesce_max=int(os.environ.get("FEISHU_PROMPT_COALESCE_MAX", "5")),
+            prompt_max_inflight=int(os.environ.get("FEISHU_PROMPT_MAX_INFLIGHT", "32")),
+            prompt_max_per_user=int(os.environ.get("FEISHU_PROMPT_MAX_PER_USER", "3")),
+            prompt_max_waiting=int(os.environ.get("FEISHU_PROMPT_MAX_WAITING", "100")),
         )
+        values.update(overrides)
+        return cls(**values)
 
     @property
     def server_base_url(self) -> str:
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable
+
+from .tokenizer import tokenize_text
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one per CJK character, one per ~4 other chars."""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+@dataclass
+class AssembledContext:
+    text: str
+    items: int
+    tokens: int
+    candidates: int
+
+
+def _jaccard(a: set[str], b: set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextAssembler:
+    """Pack the best memory candidates into a bounded prompt section.
+
+    Candidates are ranked by ``score``. Those scoring below
+    ``min_score`` times the best score are dropped. A candidate whose
+    token set overlaps an already chosen one by more than
+    ``max_overlap`` (Jaccard) is also dropped. The rest are packed in
+    until ``budget_tokens`` is reached. If at least ``min_tail_tokens``
+    remain, the first candidate that did not fit is truncated to fill
+    them.
+    """
+
+    def __init__(
+        self,
+        budget_tokens: int = 1500,
+        min_score: float = 0.2,
+        max_overlap: float = 0.6,
+        min_tail_tokens: int = 120,
+    ) -> None:
+        self._budget = budget_tokens
+        self._min_score = min_score
+        self._max_overlap = max_overlap
+        self._min_tail = min_tail_tokens
+
+    def assemble(self, candidates: list[dict[str, Any]]) -> AssembledContext:
+        ranked = sorted(candidates, key=lambda s: -float(s.get("score", 0.0)))
+        best = float(ranked[0].get("score", 0.0)) if ranked else 0.0
+        parts: list[str] = []
+        seen: list[set[str]] = []
+        used = 0
+        for s in ranked:
+            if best > 0 and float(s.get("score", 0.0)) < best * self._min_score:
+                break
+            title = s.get("title", "Untitled")
+            summary = s.get("summary", "")
+            terms = set(tokenize_text(summary))
+            if any(_jaccard(terms, other) > self._max_overlap for other in seen):
+                continue
+            block = f"### {title}\n{summary}"
+            cost = estimate_tokens(block)
+            if used + cost > self._budget:
+                remaining = self._budget - used
+                if remaining >= self._min_tail:
+                    block = self._truncate(block, remaining)
+                    parts.append(block)
+                    used += estimate_tokens(block)
+                break
+            parts.append(block)
+            seen.append(terms)
+            used += cost
+        return AssembledContext(
+            text="\n\n".join(parts),
+            items=len(parts),
+            tokens=used,
+            candidates=len(candidates),
+        )
+
+    @staticmethod
+    def _truncate(block: str, tokens: int) -> str:
+        # 二分找出不超过预算的最长前缀
+        lo, hi = 0, len(block)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if estimate_tokens(block[:mid]) + 1 <= tokens:
+                lo = mid
+            else:
+                hi = mid - 1
+        return block[:lo].rstrip() + "…"
+
+
+class ContextCache:
+    """LRU cache of assembled contexts with a TTL.
+
+    Each entry remembers the store's summary version for its user and is
+    ignored once that version moves on, so a new or updated summary is
+    visible on the very next message.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300.0) -> None:
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, int, AssembledContext]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: int) -> AssembledContext | None:
+        if self._maxsize <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, stored_version, context = entry
+            if stored_version != version or time.monotonic() - stored_at > self._ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return context
+
+    def put(self, key: Hashable, version: int, context: AssembledContext) -> None:
+        if self._maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), version, context)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import math
+from collections import Counter
+from typing import Any, Callable, Iterable
+
+
+def bm25_idf(df: int, n: int) -> float:
+    return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+
+class KeywordIndex:
+    """Inverted keyword index over session summaries.
+
+    Postings are sets so membership and removal are O(1); a forward map from
+    session to its keywords lets a summary be re-indexed in O(k) without
+    scanning the whole index. Postings are further partitioned (by user) so a
+    partition-scoped lookup never touches other partitions' sessions.
+    """
+
+    def __init__(self) -> None:
+        self._postings: dict[str, dict[str, set[str]]] = {}
+        self._df: dict[str, int] = {}
+        self._forward: dict[str, tuple[str, tuple[str, ...]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._postings)
+
+    def add(self, session_id: str, keywords: Iterable[str], partition: str = "") -> None:
+        self.remove(session_id)
+        kws = tuple(dict.fromkeys(keywords))
+        if not kws:
+            return
+        self._forward[session_id] = (partition, kws)
+        for kw in kws:
+            self._postings.setdefault(kw, {}).setdefault(partition, set()).add(
+                session_id
+            )
+            self._df[kw] = self._df.get(kw, 0) + 1
+
+    def remove(self, session_id: str) -> None:
+        partition, kws = self._forward.pop(session_id, ("", ()))
+        for kw in kws:
+            parts = self._postings.get(kw)
+            if parts is None or session_id not in parts.get(partition, ()):
+                continue
+            parts[partition].discard(session_id)
+            if not parts[partition]:
+                del parts[partition]
+            self._df[kw] -= 1
+            if not parts:
+                del self._postings[kw]
+                del self._df[kw]
+
+    def get(self, keyword: str, partition: str | None = None) -> set[str]:
+        parts = self._postings.get(keyword)
+        if not parts:
+            return set()
+        if partition is not None:
+            return parts.get(partition, set())
+        return set().union(*parts.values())
+
+    def df(self, keyword: str) -> int:
+        return self._df.get(keyword, 0)
+
+    def keywords_of(self, session_id: str) -> tuple[str, ...]:
+        return self._forward.get(session_id, ("", ()))[1]
+
+    def rebuild(self, summaries: dict[str, dict[str, Any]]) -> None:
+        self._postings.clear()
+        self._df.clear()
+        self._forward.clear()
+        for session_id, s in summaries.items():
+            self.add(session_id, s.get("keywords", []), s.get("user_id", ""))
+
+    def to_dict(self) -> dict[str, list[str]]:
+        """Serialized form: keyword -> sorted posting list."""
+        return {
+            kw: sorted(set().union(*parts.values()))
+            for kw, parts in sorted(self._postings.items())
+        }
+
+
+class TextIndex:
+    """Incrementally maintained BM25 index over summary text.
+
+    Postings are partitioned like :class:`KeywordIndex`; document frequencies
+    and lengths stay global so scores are comparable across partitions.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Callable[[str], list[str]],
+        k1: float = 1.5,
+        b: float = 0.75,
+    ) -> None:
+        self._tokenize = tokenizer
+        self._k1 = k1
+        self._b = b
+        self._postings: dict[str, dict[str, dict[str, int]]] = {}
+        self._df: dict[str, int] = {}
+        self._forward: dict[str, tuple[str, tuple[str, ...]]] = {}
+        self._doc_len: dict[str, int] = {}
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def add(self, session_id: str, text: str, partition: str = "") -> None:
+        self.remove(session_id)
+        tf = Counter(self._tokenize(text))
+        if not tf:
+            return
+        length = sum(tf.values())
+        self._doc_len[session_id] = length
+        self._total_len += length
+        self._forward[session_id] = (partition, tuple(tf))
+        for term, n in tf.items():
+            self._postings.setdefault(term, {}).setdefault(partition, {})[
+                session_id
+            ] = n
+            self._df[term] = self._df.get(term, 0) + 1
+
+    def remove(self, session_id: str) -> None:
+        length = self._doc_len.pop(session_id, None)
+        if length is None:
+            return
+        self._total_len -= length
+        partition, terms = self._forward.pop(session_id, ("", ()))
+        for term in terms:
+            parts = self._postings.get(term)
+            if parts is None or session_id not in parts.get(partition, {}):
+                continue
+            del parts[partition][session_id]
+            if not parts[partition]:
+                del parts[partition]
+            self._df[term] -= 1
+            if not parts:
+                del self._postings[term]
+                del self._df[term]
+
+    def score(
+        self, terms: Iterable[str], partition: str | None = None
+    ) -> dict[str, float]:
+        n = len(self._doc_len)
+        if n == 0:
+            return {}
+        avgdl = self._total_len / n
+        k1, b = self._k1, self._b
+        scores: dict[str, float] = {}
+        for term, qtf in Counter(terms).items():
+            parts = self._postings.get(term)
+            if not parts:
+                continue
+            if partition is not None:
+                selected = [parts[partition]] if partition in parts else []
+            else:
+                selected = list(parts.values())
+            if not selected:
+                continue
+            idf = bm25_idf(self._df[term], n) * qtf
+            for docs in selected:
+                for session_id, tf in docs.items():
+                    norm = k1 * (1.0 - b + b * self._doc_len[session_id] / avgdl)
+                    scores[session_id] = (
+                        scores.get(session_id, 0.0)
+                        + idf * tf * (k1 + 1.0) / (tf + norm)
+                    )
+        return scores
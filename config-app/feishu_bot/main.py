@@ -42,19 +42,16 @@ def main():
     )
     parser.add_argument(
         "--opencode-path",
-        default="opencode",
-        help="Path to opencode CLI (default: opencode)",
+        help="Path to opencode CLI (or OPENCODE_PATH env, default: opencode)",
     )
     parser.add_argument("--working-dir", help="Working directory for opencode")
     parser.add_argument(
         "--model",
-        default="fox-cc/claude-opus-4-6",
-        help="OpenCode model (default: fox-cc/claude-opus-4-6)",
+        help="OpenCode model (or OPENCODE_MODEL env, default: fox-cc/claude-opus-4-6)",
     )
     parser.add_argument(
         "--log-level",
-        default="INFO",
-        help="Log level: DEBUG/INFO/WARN/ERROR (default: INFO)",
+        help="Log level: DEBUG/INFO/WARN/ERROR (or FEISHU_LOG_LEVEL env, default: INFO)",
     )
     parser.add_argument(
         "--server-host",
@@ -77,46 +74,43 @@ def main():
 
     args = parser.parse_args()
 
-    app_id = args.app_id or os.environ.get("FEISHU_APP_ID")
-    app_secret = args.app_secret or os.environ.get("FEISHU_APP_SECRET")
+    # 先从环境变量读取全部配置（存储、记忆、并发等），显式给出的命令行参数覆盖之
+    overrides = {
+        "app_id": args.app_id,
+        "app_secret": args.app_secret,
+        "opencode_path": args.opencode_path,
+        "working_dir": args.working_dir,
+        "model": args.model,
+        "log_level": args.log_level,
+        "opencode_server_host": args.server_host,
+        "opencode_server_port": args.server_port,
+        "opencode_server_password": args.server_password,
+        "use_server_mode": False if args.no_server else None,
+    }
+    config = FeishuConfig.from_env(
+        **{key: value for key, value in overrides.items() if value is not None}
+    )
 
-    if not app_id:
+    if not config.app_id:
         print(
             "Error: App ID required. Use --app-id or set FEISHU_APP_ID env",
             file=sys.stderr,
         )
         sys.exit(1)
-    if not app_secret:
+    if not config.app_secret:
         print(
             "Error: App Secret required. Use --app-secret or set FEISHU_APP_SECRET env",
             file=sys.stderr,
         )
         sys.exit(1)
 
-    server_host = args.server_host or os.environ.get(
-        "OPENCODE_SERVER_HOST", "127.0.0.1"
-    )
-    server_port = args.server_port or int(
-        os.environ.get("OPENCODE_SERVER_PORT", "4096")
-    )
-    server_password = args.server_password or os.environ.get("OPENCODE_SERVER_PASSWORD")
-    use_server = not args.no_server
-
-    config = FeishuConfig(
-        app_id=app_id,
-        app_secret=app_secret,
-        opencode_path=args.opencode_path,
-        working_dir=args.working_dir,
-        model=args.model,
-        log_level=args.log_level,
-        opencode_server_host=server_host,
-        opencode_server_port=server_port,
-        opencode_server_password=server_password,
-        use_server_mode=use_server,
-    )
-
     bot = FeishuBot(config)
-    bot.start()
+    # SIGTERM 转为正常退出，保证 finally 中的落盘逻辑执行
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        bot.start()
+    finally:
+        bot.stop()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,18 @@
 from __future__ import annotations
 
 import json
+import random
 import threading
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Iterator, Optional
 
 import requests
 from requests.auth import HTTPBasicAuth
 
+# 服务端约 30s 发一次心跳，超过该时长无任何数据视为连接已死
+_SSE_HEARTBEAT_TIMEOUT = 75.0
+_SSE_RETRY_BASE = 1.0
+_SSE_RETRY_MAX = 30.0
+
 
 class OpenCodeClient:
     def __init__(
@@ -20,6 +26,7 @@ class OpenCodeClient:
         self._session = requests.Session()
         if self._auth:
             self._session.auth = self._auth
+        self._closed = threading.Event()
 
     def health_check(self) -> bool:
         try:
@@ -62,13 +69,17 @@ class OpenCodeClient:
         resp = self._session.get(f"{self.base_url}/session", timeout=10)
         resp.raise_for_status()
         sessions = resp.json()
-        return [
-            s
-            for s in sessions
-            if not s.get("parentID")
-            and isinstance(s.get("title", ""), str)
-            and s.get("title", "").startswith("feishu-")
-        ]
+        return [s for s in sessions if self.is_feishu_session(s)]
+
+    @staticmethod
+    def is_feishu_session(session: dict[str, Any]) -> bool:
+        """Top-level sessions created by the bot (titled ``feishu-*``)."""
+        title = session.get("title", "")
+        return (
+            not session.get("parentID")
+            and isinstance(title, str)
+            and title.startswith("feishu-")
+        )
 
     def get_session(self, session_id: str) -> dict[str, Any]:
         resp = self._session.get(f"{self.base_url}/session/{session_id}", timeout=10)
@@ -128,6 +139,7 @@ class OpenCodeClient:
         provider_id: str = "anthropic",
         model_id: str = "claude-sonnet-4-20250514",
         auto: bool = True,
+        timeout: float = 300,
     ) -> bool:
         """POST /session/{id}/summarize — AI compaction summary."""
         resp = self._session.post(
@@ -137,7 +149,7 @@ class OpenCodeClient:
                 "modelID": model_id,
                 "auto": auto,
             },
-            timeout=300,
+            timeout=timeout,
         )
         resp.raise_for_status()
         return resp.json()
@@ -160,41 +172,104 @@ class OpenCodeClient:
         self,
         on_event: Callable[[dict[str, Any]], None],
         on_error: Callable[[Exception], None] | None = None,
+        on_reconnect: Callable[[], None] | None = None,
+        heartbeat_timeout: float = _SSE_HEARTBEAT_TIMEOUT,
     ) -> threading.Thread:
         """GET /global/event — SSE long-lived connection.
 
         Returns the daemon thread so the caller can track it.
         Events are dicts like ``{"directory": "...", "payload": {"type": "...", "properties": {...}}}``.
+
+        The connection is re-opened with exponential backoff whenever it
+        drops or stays silent for *heartbeat_timeout* seconds, sending
+        ``Last-Event-ID`` if the server has supplied event ids.
+        *on_reconnect* runs after every successful re-connection so the
+        caller can reconcile state that changed while it was offline.
         """
 
         def _listen() -> None:
-            try:
-                resp = self._session.get(
-                    f"{self.base_url}/global/event",
-                    stream=True,
-                    timeout=None,
-                )
-                resp.raise_for_status()
-                for line in resp.iter_lines(decode_unicode=True):
-                    if not line:
-                        continue
-                    if line.startswith("data:"):
-                        raw = line[len("data:") :].strip()
-                        if not raw:
-                            continue
+            last_event_id = ""
+            attempt = 0
+            connected_before = False
+            while not self._closed.is_set():
+                try:
+                    headers = {"Accept": "text/event-stream"}
+                    if last_event_id:
+                        headers["Last-Event-ID"] = last_event_id
+                    # 读超时即心跳超时：iter_lines 在静默过久时抛出异常
+                    resp = self._session.get(
+                        f"{self.base_url}/global/event",
+                        stream=True,
+                        headers=headers,
+                        timeout=(10, heartbeat_timeout),
+                    )
+                    resp.raise_for_status()
+                    if connected_before and on_reconnect:
+                        try:
+                            on_reconnect()
+                        except Exception as exc:
+                            if on_error:
+                                on_error(exc)
+                    connected_before = True
+                    for event_id, event in self._iter_events(resp):
+                        # 收到事件才算连接恢复正常，重置退避
+                        attempt = 0
+                        if event_id:
+                            last_event_id = event_id
+                        # 回调出错只上报，不应断开连接
                         try:
-                            event = json.loads(raw)
                             on_event(event)
-                        except json.JSONDecodeError:
-                            pass
-            except Exception as exc:
-                if on_error:
-                    on_error(exc)
+                        except Exception as exc:
+                            if on_error:
+                                on_error(exc)
+                    resp.close()
+                    if self._closed.is_set():
+                        return
+                    raise ConnectionError("event stream closed by server")
+                except Exception as exc:
+                    if self._closed.is_set():
+                        return
+                    if on_error:
+                        on_error(exc)
+                    delay = min(_SSE_RETRY_BASE * 2**attempt, _SSE_RETRY_MAX)
+                    attempt += 1
+                    # 加入抖动，避免多个实例同时重连
+                    self._closed.wait(delay * random.uniform(0.5, 1.0))
 
         t = threading.Thread(target=_listen, daemon=True)
         t.start()
         return t
 
+    def _iter_events(
+        self, resp: requests.Response
+    ) -> Iterator[tuple[str, dict[str, Any]]]:
+        """Yield ``(event_id, event)`` for each complete SSE event."""
+        # SSE 规定为 UTF-8；响应头没有 charset 时 requests 会按 ISO-8859-1 解码
+        resp.encoding = "utf-8"
+        data: list[str] = []
+        event_id = ""
+        for line in resp.iter_lines(decode_unicode=True):
+            if self._closed.is_set():
+                return
+            if line is None:
+                continue
+            if not line:
+                # 空行表示一个事件结束
+                raw = "\n".join(data).strip()
+                data = []
+                if not raw:
+                    continue
+                try:
+                    event = json.loads(raw)
+                except json.JSONDecodeError:
+                    continue
+                yield event_id, event
+                continue
+            if line.startswith("data:"):
+                data.append(line[len("data:") :].lstrip())
+            elif line.startswith("id:"):
+                event_id = line[len("id:") :].strip()
+
     def get_all_session_status(self) -> dict[str, Any]:
         """GET /session/status — status of all sessions."""
         resp = self._session.get(f"{self.base_url}/session/status", timeout=10)
@@ -202,4 +277,5 @@ class OpenCodeClient:
         return resp.json()
 
     def close(self) -> None:
+        self._closed.set()
         self._session.close()
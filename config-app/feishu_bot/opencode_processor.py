@@ -1,21 +1,33 @@
 from __future__ import annotations
 
+import asyncio
 import os
-import re
 import shutil
-import subprocess
 import threading
 import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Optional, Callable, Dict
+from typing import Any, Coroutine, Optional, Callable, Dict
 
+from .admission import AdmissionController
 from .config import FeishuConfig
 from .opencode_client import OpenCodeClient
-from .store import JsonStore, CHINESE_STOPWORDS, ENGLISH_STOPWORDS
+from .store import JsonStore
+from .context import ContextAssembler, ContextCache
+from .tokenizer import query_terms
 
 _POLL_INTERVAL = 3.0
 _POLL_TIMEOUT = 1800.0
+# 事件循环中阻塞调用（HTTP、飞书回调、记忆检索）所用线程池大小
+_IO_WORKERS = 32
+# 排队提示、拒绝提示等卡片更新用的独立线程池，不占用 OpenCode 请求的线程
+_CARD_WORKERS = 2
+_REJECTED_NOTICE = "当前请求过多，请稍后再试"
+_COALESCED_NOTICE = "该消息已与后续消息合并处理，回复见最新一条"
+# 倒数排名融合的平滑常数
+_RRF_K = 60
 
 _OPENCODE_SEARCH_PATHS = [
     Path.home() / ".opencode" / "bin" / "opencode",
@@ -42,6 +54,15 @@ class _PendingPrompt:
         "progress_callback",
         "error_callback",
         "created_at",
+        "sent",
+        "parts",
+        "assistant_id",
+        "streamed",
+        "todos",
+        "missed_events",
+        "timeout_handle",
+        "callback_lock",
+        "sender",
     )
 
     def __init__(
@@ -51,6 +72,7 @@ class _PendingPrompt:
         reply_callback: Callable[[str, str], bool],
         progress_callback: Optional[Callable[[str, str], None]],
         error_callback: Optional[Callable[[str, str], None]],
+        sender: str = "",
     ):
         self.session_id = session_id
         self.message_id = message_id
@@ -58,6 +80,55 @@ class _PendingPrompt:
         self.progress_callback = progress_callback
         self.error_callback = error_callback
         self.created_at = time.time()
+        # prompt_async 返回后才置位；此前 session 仍是上一轮的状态，不能据此判定完成
+        self.sent = False
+        # SSE 增量累积的文本 part：part_id -> (message_id, text)
+        self.parts: Dict[str, tuple[str, str]] = {}
+        self.assistant_id = ""
+        self.streamed = ""
+        self.todos: Optional[list[dict[str, Any]]] = None
+        # SSE 断线期间可能丢了增量，完成时需回拉完整消息
+        self.missed_events = False
+        self.timeout_handle: Optional[asyncio.TimerHandle] = None
+        # 串行执行同一 prompt 的回调，保证进度更新不会覆盖最终回复
+        self.callback_lock = asyncio.Lock()
+        self.sender = sender
+
+
+class _QueuedPrompt:
+    __slots__ = (
+        "message_id",
+        "sender",
+        "text",
+        "reply_callback",
+        "progress_callback",
+        "error_callback",
+        "queued_callback",
+        "rejected_callback",
+        "position",
+    )
+
+    def __init__(
+        self,
+        message_id: str,
+        sender: str,
+        text: str,
+        reply_callback: Callable[[str, str], bool],
+        progress_callback: Optional[Callable[[str, str], None]],
+        error_callback: Optional[Callable[[str, str], None]],
+        queued_callback: Optional[Callable[[str, int], None]] = None,
+        rejected_callback: Optional[Callable[[str], None]] = None,
+    ):
+        self.message_id = message_id
+        self.sender = sender
+        self.text = text
+        self.reply_callback = reply_callback
+        self.progress_callback = progress_callback
+        self.error_callback = error_callback
+        self.queued_callback = queued_callback
+        self.rejected_callback = rejected_callback
+        # 最近一次通知的排队位置，0 表示未排队或已放行
+        self.position = 0
 
 
 class OpenCodeProcessor:
@@ -66,9 +137,33 @@ class OpenCodeProcessor:
         self._store = store
         self._user_sessions: Dict[str, str] = {}
         self._client: Optional[OpenCodeClient] = None
+        # pending 只在事件循环线程中修改
         self._pending: Dict[str, _PendingPrompt] = {}
-        self._pending_lock = threading.Lock()
+        # session 忙时到达的消息按 FIFO 排队，上一条完成后再发送
+        self._queues: Dict[str, deque[_QueuedPrompt]] = {}
+        # asyncio.Lock 按等待顺序唤醒，用来让同一用户的消息保持到达顺序
+        self._sender_locks: Dict[str, asyncio.Lock] = {}
+        self._admission: AdmissionController[_QueuedPrompt] = AdmissionController(
+            max_inflight=config.prompt_max_inflight,
+            max_per_user=config.prompt_max_per_user,
+            max_waiting=config.prompt_max_waiting,
+        )
+        # 待发送的排队位置（每条消息只保留最新值），由单个任务依次发送
+        self._position_updates: Dict[_QueuedPrompt, int] = {}
+        self._position_task: Optional[asyncio.Task[Any]] = None
+        self._card_executor: Optional[ThreadPoolExecutor] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._tasks: set[asyncio.Task[Any]] = set()
         self._sse_thread: Optional[threading.Thread] = None
+        self._idle_listeners: list[Callable[[str], None]] = []
+        self._assembler = ContextAssembler(
+            budget_tokens=config.memory_context_tokens,
+            min_score=config.memory_min_score,
+        )
+        self._context_cache = ContextCache(
+            maxsize=config.memory_cache_size, ttl=config.memory_cache_ttl
+        )
 
         if config.use_server_mode:
             self._client = OpenCodeClient(
@@ -86,13 +181,74 @@ class OpenCodeProcessor:
         self._sse_thread = self._client.subscribe_events(
             on_event=self._on_sse_event,
             on_error=self._on_sse_error,
+            on_reconnect=self._reconcile_pending,
         )
         print(
             f"[{datetime.now().isoformat()}] SSE event listener started",
             flush=True,
         )
 
+    def add_idle_listener(self, callback: Callable[[str], None]) -> None:
+        """Call *callback(session_id)* on every ``session.idle`` event."""
+        self._idle_listeners.append(callback)
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """Start the processor's event loop thread on first use.
+
+        Every prompt, SSE event, status poll and timeout is handled by
+        coroutines on this one loop. Blocking calls (HTTP via requests,
+        the Feishu callbacks, memory retrieval) go to a bounded thread
+        pool with ``asyncio.to_thread``.
+        """
+        with self._loop_lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(
+                ThreadPoolExecutor(
+                    max_workers=_IO_WORKERS, thread_name_prefix="opencode-io"
+                )
+            )
+            self._card_executor = ThreadPoolExecutor(
+                max_workers=_CARD_WORKERS, thread_name_prefix="feishu-card"
+            )
+            threading.Thread(
+                target=loop.run_forever, name="opencode-loop", daemon=True
+            ).start()
+            self._loop = loop
+        if self._client:
+            loop.call_soon_threadsafe(self._spawn, self._poll_loop())
+        return loop
+
+    def _submit(self, coro: Coroutine[Any, Any, Any]) -> Future[Any]:
+        """Run *coro* on the event loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def _spawn(self, coro: Coroutine[Any, Any, Any]) -> asyncio.Task[Any]:
+        # 仅在事件循环线程调用；保留引用防止任务被回收
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def stop(self) -> None:
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop)
+
+    async def _shutdown(self) -> None:
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        asyncio.get_running_loop().stop()
+
     def _on_sse_event(self, event: dict[str, Any]) -> None:
+        # SSE 线程只负责转交，状态全部在事件循环中处理
+        self._ensure_loop().call_soon_threadsafe(self._dispatch_event, event)
+
+    def _dispatch_event(self, event: dict[str, Any]) -> None:
         payload = event.get("payload", {})
         event_type = payload.get("type", "")
         props = payload.get("properties", {})
@@ -106,35 +262,119 @@ class OpenCodeProcessor:
             props.get("sessionID", "")
             or props.get("session_id", "")
             or props.get("info", {}).get("sessionID", "")
+            or props.get("part", {}).get("sessionID", "")
         )
         if not session_id:
             return
 
-        with self._pending_lock:
-            pending = self._pending.get(session_id)
+        if event_type == "session.idle":
+            for listener in self._idle_listeners:
+                try:
+                    listener(session_id)
+                except Exception as e:
+                    print(
+                        f"[{datetime.now().isoformat()}] idle listener failed: {e}",
+                        flush=True,
+                    )
+
+        pending = self._pending.get(session_id)
         if not pending:
             return
 
         # session.idle = AI 处理完毕的最终信号
         if event_type == "session.idle":
+            if not pending.sent:
+                return
             print(
                 f"[{datetime.now().isoformat()}] [SSE] "
                 f"session.idle for {session_id[:8]}",
                 flush=True,
             )
-            self._handle_prompt_completed(pending)
-        elif event_type in (
-            "session.updated",
-            "message.updated",
-            "message.part.updated",
-        ):
+            self._spawn(self._handle_prompt_completed(pending))
+            return
+
+        # 其余事件只更新 pending 上的增量状态，不再回拉消息列表
+        changed = False
+        if event_type == "message.updated":
+            info = props.get("info", {})
+            if info.get("role") == "assistant" and info.get("id"):
+                pending.assistant_id = info["id"]
+                changed = True
+        elif event_type == "message.part.updated":
+            changed = self._apply_part(
+                pending, props.get("part", {}), props.get("delta")
+            )
+        elif event_type == "todo.updated":
+            todos = props.get("todos")
+            if isinstance(todos, list):
+                pending.todos = todos
+                changed = True
+        if not changed:
+            return
+
+        text = self._streamed_text(pending)
+        if text != pending.streamed or event_type == "todo.updated":
+            pending.streamed = text
             if pending.progress_callback:
-                partial = ""
-                try:
-                    partial = self._extract_last_assistant_message(session_id)
-                except Exception:
-                    pass
-                pending.progress_callback(session_id, partial)
+                self._spawn(self._notify_progress(pending))
+
+    async def _notify_progress(self, pending: _PendingPrompt) -> None:
+        # 上一次进度回调仍在执行时直接跳过，下次发送时会带上最新文本
+        if pending.callback_lock.locked() or not pending.progress_callback:
+            return
+        async with pending.callback_lock:
+            if self._pending.get(pending.session_id) is not pending:
+                return
+            try:
+                await asyncio.to_thread(
+                    pending.progress_callback, pending.session_id, pending.streamed
+                )
+            except Exception as e:
+                print(
+                    f"[{datetime.now().isoformat()}] progress callback failed: {e}",
+                    flush=True,
+                )
+
+    async def _run_callback(
+        self, pending: _PendingPrompt, callback: Callable[..., Any], *args: Any
+    ) -> None:
+        async with pending.callback_lock:
+            await asyncio.to_thread(callback, *args)
+
+    @staticmethod
+    def _apply_part(pending: _PendingPrompt, part: dict[str, Any], delta: Any) -> bool:
+        if not isinstance(part, dict) or part.get("type") != "text":
+            return False
+        part_id = part.get("id", "")
+        if not part_id:
+            return False
+        text = part.get("text")
+        if not isinstance(text, str):
+            # 没有完整快照时把 delta 追加到已有文本上
+            if not isinstance(delta, str) or not delta:
+                return False
+            text = pending.parts.get(part_id, ("", ""))[1] + delta
+        pending.parts[part_id] = (part.get("messageID", ""), text)
+        return True
+
+    @staticmethod
+    def _streamed_text(pending: _PendingPrompt) -> str:
+        """First non-empty text part of the latest assistant message."""
+        if not pending.assistant_id:
+            return ""
+        for message_id, text in pending.parts.values():
+            if message_id == pending.assistant_id and text.strip():
+                return text.strip()
+        return ""
+
+    def is_session_active(self, session_id: str) -> bool:
+        """Whether a prompt for *session_id* is running or queued."""
+        return session_id in self._pending or bool(self._queues.get(session_id))
+
+    def get_streamed_todos(self, session_id: str) -> Optional[list[dict[str, Any]]]:
+        """Todos last pushed over SSE for a pending prompt, or None."""
+        pending = self._pending.get(session_id)
+        return pending.todos if pending else None
 
     def _on_sse_error(self, exc: Exception) -> None:
         print(
@@ -142,26 +382,81 @@ class OpenCodeProcessor:
             flush=True,
         )
 
-    def _handle_prompt_completed(self, pending: _PendingPrompt) -> None:
+    def _reconcile_pending(self) -> None:
+        """Catch up on pending prompts after the SSE stream reconnects.
+
+        Sessions that went idle while disconnected are completed right
+        away; the rest are marked so their final text is refetched.
+        """
+        self._submit(self._reconcile())
+
+    async def _reconcile(self) -> None:
+        pending_list = list(self._pending.values())
+        if not pending_list or not self._client:
+            return
+        print(
+            f"[{datetime.now().isoformat()}] [SSE] Reconnected, "
+            f"reconciling {len(pending_list)} pending prompt(s)",
+            flush=True,
+        )
+        all_status = await asyncio.to_thread(self._client.get_all_session_status)
+        done = []
+        for pending in pending_list:
+            if not pending.sent:
+                continue
+            pending.missed_events = True
+            if all_status.get(pending.session_id, {}).get("type") != "busy":
+                done.append(self._handle_prompt_completed(pending, refetch=True))
+        await asyncio.gather(*done)
+
+    async def _handle_prompt_completed(
+        self, pending: _PendingPrompt, refetch: bool = False
+    ) -> None:
         sid = pending.session_id
-        with self._pending_lock:
-            self._pending.pop(sid, None)
+        # SSE、轮询兜底和重连对账可能同时判定完成，只处理一次
+        if self._pending.get(sid) is not pending:
+            return
+        del self._pending[sid]
+        if pending.timeout_handle:
+            pending.timeout_handle.cancel()
         try:
-            text = self._extract_last_assistant_message(sid)
+            try:
+                # SSE 已经累积出文本时直接使用；轮询兜底说明可能丢过事件，需回拉
+                refetch = refetch or pending.missed_events
+                text = "" if refetch else self._streamed_text(pending)
+                if not text:
+                    text = await asyncio.to_thread(
+                        self._extract_last_assistant_message, sid
+                    )
+            finally:
+                # 本轮回复已取到，再把队列中的下一条发给 session
+                self._dispatch_next(sid)
             print(
                 f"[{datetime.now().isoformat()}] [COMPLETE] "
                 f"session={sid[:8]} text_len={len(text)} text_preview={text[:80]!r}",
                 flush=True,
             )
             if text:
-                pending.reply_callback(pending.message_id, text)
+                await self._run_callback(
+                    pending, pending.reply_callback, pending.message_id, text
+                )
             elif pending.error_callback:
-                pending.error_callback(
-                    pending.message_id, "AI 未返回任何内容，请稍后重试"
+                await self._run_callback(
+                    pending,
+                    pending.error_callback,
+                    pending.message_id,
+                    "AI 未返回任何内容，请稍后重试",
                 )
         except Exception as e:
             if pending.error_callback:
-                pending.error_callback(pending.message_id, f"处理失败: {e}")
+                await self._run_callback(
+                    pending,
+                    pending.error_callback,
+                    pending.message_id,
+                    f"处理失败: {e}",
+                )
+        finally:
+            self._release(pending.sender)
 
     def process_message_async(
         self,
@@ -171,136 +466,301 @@ class OpenCodeProcessor:
         reply_callback: Callable[[str, str], bool],
         progress_callback: Optional[Callable[[str, str], None]] = None,
         error_callback: Optional[Callable[[str, str], None]] = None,
+        queued_callback: Optional[Callable[[str, int], None]] = None,
+        rejected_callback: Optional[Callable[[str], None]] = None,
     ) -> None:
-        prompt = self._build_prompt(sender, text)
-
-        thread = threading.Thread(
-            target=self._process_and_reply,
-            args=(
-                message_id,
-                sender,
-                prompt,
-                reply_callback,
-                progress_callback,
-                error_callback,
-            ),
-            daemon=True,
+        """Submit a message for processing.
+
+        *queued_callback(message_id, position)* is called when the
+        message has to wait for admission, whenever its position changes
+        and with position 0 once it is admitted. *rejected_callback
+        (message_id)* is called instead if it is shed because the wait
+        queue is full.
+        """
+        item = _QueuedPrompt(
+            message_id,
+            sender,
+            text,
+            reply_callback,
+            progress_callback,
+            error_callback,
+            queued_callback,
+            rejected_callback,
         )
-        thread.start()
+        self._ensure_loop().call_soon_threadsafe(self._admit, item)
 
-    def _poll_timeout(self, session_id: str) -> None:
-        time.sleep(_POLL_TIMEOUT)
-        with self._pending_lock:
-            pending = self._pending.pop(session_id, None)
-        if pending and pending.error_callback:
-            pending.error_callback(pending.message_id, "处理超时，请重试")
+    def _admit(self, item: _QueuedPrompt) -> None:
+        position = self._admission.submit(item.sender, item)
+        if position == 0:
+            self._spawn(self._process_and_reply(item))
+            return
+        if position is None:
+            print(
+                f"[{datetime.now().isoformat()}] [ADMISSION] "
+                f"Wait queue full, shedding message {item.message_id}",
+                flush=True,
+            )
+            if item.rejected_callback:
+                self._spawn(self._run_card(item.rejected_callback, item.message_id))
+            elif item.error_callback:
+                self._spawn(
+                    self._run_card(
+                        item.error_callback, item.message_id, _REJECTED_NOTICE
+                    )
+                )
+            return
+        print(
+            f"[{datetime.now().isoformat()}] [ADMISSION] "
+            f"{self._admission.inflight} in flight, message {item.message_id} "
+            f"waiting at position {position}",
+            flush=True,
+        )
+        self._queue_position(item, position)
+
+    def _release(self, sender: str) -> None:
+        """A message of *sender* is done; let waiting messages in."""
+        admitted = self._admission.release(sender)
+        if not admitted:
+            return
+        for item in admitted:
+            if item.queued_callback and item.position:
+                # 排队卡片先刷成处理中再开始处理，避免迟到的排队提示盖住回复
+                self._queue_position(item, 0)
+            else:
+                self._spawn(self._process_and_reply(item))
+        # 排在后面的消息位置前移，刷新它们的排队提示
+        for position, item in enumerate(self._admission.waiting(), 1):
+            self._queue_position(item, position)
+
+    def _queue_position(self, item: _QueuedPrompt, position: int) -> None:
+        if not item.queued_callback or item.position == position:
+            return
+        item.position = position
+        self._position_updates[item] = position
+        if self._position_task is None:
+            self._position_task = self._spawn(self._send_positions())
+
+    async def _send_positions(self) -> None:
+        """Deliver queued position updates one at a time, oldest first.
+
+        A single sender keeps a message's updates in order, and a message
+        whose position changes again before its turn only gets the latest.
+        Admissions go first, and an admitted message starts processing once
+        its card says so.
+        """
+        try:
+            while self._position_updates:
+                item = next(
+                    (i for i, p in self._position_updates.items() if p == 0),
+                    next(iter(self._position_updates)),
+                )
+                position = self._position_updates.pop(item)
+                await self._run_card(item.queued_callback, item.message_id, position)
+                if position == 0:
+                    self._spawn(self._process_and_reply(item))
+        finally:
+            self._position_task = None
+
+    async def _run_card(self, callback: Callable[..., Any], *args: Any) -> None:
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._card_executor, callback, *args
+            )
+        except Exception as e:
+            print(
+                f"[{datetime.now().isoformat()}] [ADMISSION] card update failed: {e}",
+                flush=True,
+            )
+
+    def _expire(self, pending: _PendingPrompt) -> None:
+        if self._pending.get(pending.session_id) is not pending:
+            return
+        del self._pending[pending.session_id]
+        self._dispatch_next(pending.session_id)
+        self._release(pending.sender)
+        if pending.error_callback:
+            self._spawn(
+                self._run_callback(
+                    pending,
+                    pending.error_callback,
+                    pending.message_id,
+                    "处理超时，请重试",
+                )
+            )
 
-    def _poll_session_status(self, session_id: str) -> None:
+    async def _poll_loop(self) -> None:
         """轮询兜底：防止 SSE 丢事件导致回调永远不触发。
 
-        使用 /session/status 端点检查会话是否仍在 busy 状态。
-        当 session_id 不再出现在 busy 列表中，说明 AI 处理完毕。
+        每个周期只请求一次 /session/status，覆盖全部 pending 会话；
+        session 不再 busy 即说明 AI 处理完毕。
         """
-        # 等一小段时间让 prompt_async 生效，session 进入 busy
-        time.sleep(_POLL_INTERVAL * 2)
         while True:
-            time.sleep(_POLL_INTERVAL)
-            with self._pending_lock:
-                pending = self._pending.get(session_id)
-            if not pending:
-                return
+            await asyncio.sleep(_POLL_INTERVAL)
+            # 刚发出的 prompt 留一点时间让 session 进入 busy
+            cutoff = time.time() - _POLL_INTERVAL * 2
+            due = [
+                p for p in self._pending.values() if p.sent and p.created_at <= cutoff
+            ]
+            if not due or not self._client:
+                continue
             try:
-                assert self._client is not None
-                all_status = self._client.get_all_session_status()
-                session_info = all_status.get(session_id, {})
-                is_busy = session_info.get("type") == "busy"
-
-                if not is_busy:
-                    with self._pending_lock:
-                        still_pending = self._pending.get(session_id)
-                    if still_pending:
-                        print(
-                            f"[{datetime.now().isoformat()}] [POLL] "
-                            f"Session {session_id[:8]} no longer busy, "
-                            f"completing via poll fallback",
-                            flush=True,
-                        )
-                        self._handle_prompt_completed(still_pending)
-                    return
+                all_status = await asyncio.to_thread(
+                    self._client.get_all_session_status
+                )
             except Exception as exc:
                 print(
                     f"[{datetime.now().isoformat()}] [POLL] "
-                    f"Error polling session {session_id[:8]}: {exc}",
+                    f"Error polling {len(due)} session(s): {exc}",
                     flush=True,
                 )
-
-    def _process_and_reply(
-        self,
-        message_id: str,
-        sender: str,
-        prompt: str,
-        reply_callback: Callable[[str, str], bool],
-        progress_callback: Optional[Callable[[str, str], None]] = None,
-        error_callback: Optional[Callable[[str, str], None]] = None,
-    ) -> None:
-        try:
-            # ── 异步路径：Server 可用时使用 prompt_async + SSE ──
-            if self._client and self._is_server_available():
-                session_id = self._get_or_create_session(sender)
+                continue
+            for pending in due:
+                session_info = all_status.get(pending.session_id, {})
+                if session_info.get("type") == "busy":
+                    continue
+                if self._pending.get(pending.session_id) is not pending:
+                    continue
                 print(
-                    f"[{datetime.now().isoformat()}] [ASYNC] "
-                    f"Sending prompt_async to session {session_id[:8]}...",
+                    f"[{datetime.now().isoformat()}] [POLL] "
+                    f"Session {pending.session_id[:8]} no longer busy, "
+                    f"completing via poll fallback",
                     flush=True,
                 )
+                self._spawn(self._handle_prompt_completed(pending, refetch=True))
 
-                # 注册 pending，SSE 事件处理器会消费它
-                pending = _PendingPrompt(
-                    session_id=session_id,
-                    message_id=message_id,
-                    reply_callback=reply_callback,
-                    progress_callback=progress_callback,
-                    error_callback=error_callback,
+    def _dispatch_next(self, session_id: str) -> None:
+        """Send the next queued prompt(s) of *session_id*, if any.
+
+        Up to ``prompt_coalesce_max`` prompts that piled up while the
+        session was busy are merged and sent as one.
+        """
+        queue = self._queues.get(session_id)
+        if not queue or session_id in self._pending:
+            return
+        limit = max(1, self.config.prompt_coalesce_max)
+        items = [queue.popleft() for _ in range(min(limit, len(queue)))]
+        if not queue:
+            del self._queues[session_id]
+        self._dispatch(session_id, items)
+
+    def _enqueue(self, session_id: str, item: _QueuedPrompt) -> None:
+        # 同步执行：检查与登记之间没有 await，在事件循环中是原子的
+        queue = self._queues.get(session_id)
+        if session_id in self._pending or queue:
+            if queue is None:
+                queue = self._queues[session_id] = deque()
+            queue.append(item)
+            print(
+                f"[{datetime.now().isoformat()}] [QUEUE] "
+                f"Session {session_id[:8]} busy, queued prompt "
+                f"(position {len(queue)})",
+                flush=True,
+            )
+            return
+        self._dispatch(session_id, [item])
+
+    def _dispatch(self, session_id: str, items: list[_QueuedPrompt]) -> None:
+        last = items[-1]
+        # 先登记 pending 占住 session，后续消息会进入队列
+        pending = _PendingPrompt(
+            session_id=session_id,
+            message_id=last.message_id,
+            reply_callback=last.reply_callback,
+            progress_callback=last.progress_callback,
+            error_callback=last.error_callback,
+            sender=last.sender,
+        )
+        self._pending[session_id] = pending
+        # 合并的较早消息不再单独回复，告知其回复见最后一条
+        for item in items[:-1]:
+            self._spawn(
+                asyncio.to_thread(
+                    item.reply_callback, item.message_id, _COALESCED_NOTICE
                 )
-                with self._pending_lock:
-                    self._pending[session_id] = pending
+            )
+            self._release(item.sender)
+        if len(items) > 1:
+            print(
+                f"[{datetime.now().isoformat()}] [QUEUE] "
+                f"Coalesced {len(items)} prompts for session {session_id[:8]}",
+                flush=True,
+            )
+        self._spawn(self._send_prompt(pending, items))
 
-                # 发送异步 prompt（立即返回，不阻塞）
-                try:
-                    self._client.prompt_async(session_id, prompt)
-                except Exception as exc:
-                    # prompt_async 失败时清理 pending 并报错
-                    with self._pending_lock:
-                        self._pending.pop(session_id, None)
-                    raise exc
-
-                # 启动超时看门狗线程
-                threading.Thread(
-                    target=self._poll_timeout,
-                    args=(session_id,),
-                    daemon=True,
-                ).start()
-
-                # 启动轮询兜底线程（防止 SSE 丢事件）
-                threading.Thread(
-                    target=self._poll_session_status,
-                    args=(session_id,),
-                    daemon=True,
-                ).start()
-
-                # 异步路径到此结束，后续由 SSE / 轮询兜底完成回调
-                return
+    async def _send_prompt(
+        self, pending: _PendingPrompt, items: list[_QueuedPrompt]
+    ) -> None:
+        session_id = pending.session_id
+        last = items[-1]
+        try:
+            text = "\n\n".join(item.text for item in items)
+            prompt = await asyncio.to_thread(self._build_prompt, last.sender, text)
+            print(
+                f"[{datetime.now().isoformat()}] [ASYNC] "
+                f"Sending prompt_async to session {session_id[:8]}...",
+                flush=True,
+            )
+            # 发送异步 prompt（立即返回，不阻塞）
+            assert self._client is not None
+            await asyncio.to_thread(self._client.prompt_async, session_id, prompt)
+            # 从发出时刻起计算轮询兜底的宽限期，构建 prompt 的耗时不算在内
+            pending.created_at = time.time()
+            pending.sent = True
+        except Exception as e:
+            # 发送失败时释放 session 并报错，队列继续处理
+            if self._pending.get(session_id) is pending:
+                del self._pending[session_id]
+            self._dispatch_next(session_id)
+            self._release(last.sender)
+            print(f"[{datetime.now().isoformat()}] Error: {e}", flush=True)
+            if last.error_callback:
+                await self._run_callback(
+                    pending, last.error_callback, last.message_id, f"处理失败: {e}"
+                )
+            return
+
+        # 超时交给事件循环的定时器；轮询兜底由 _poll_loop 统一负责
+        # 异步路径到此结束，后续由 SSE / 轮询兜底完成回调
+        pending.timeout_handle = asyncio.get_running_loop().call_later(
+            _POLL_TIMEOUT, self._expire, pending
+        )
+
+    def _sender_lock(self, sender: str) -> asyncio.Lock:
+        lock = self._sender_locks.get(sender)
+        if lock is None:
+            lock = self._sender_locks[sender] = asyncio.Lock()
+        return lock
+
+    async def _process_and_reply(self, item: _QueuedPrompt) -> None:
+        message_id = item.message_id
+        reply_callback = item.reply_callback
+        error_callback = item.error_callback
+        # 交给 session 队列后由 pending 完成时释放准入名额
+        handed_off = False
+        try:
+            # 同一用户的消息按到达顺序依次完成会话查找与登记，保证 FIFO
+            async with self._sender_lock(item.sender):
+                # ── 异步路径：Server 可用时使用 prompt_async + SSE ──
+                if self._client and await asyncio.to_thread(self._is_server_available):
+                    session_id = await asyncio.to_thread(
+                        self._get_or_create_session, item.sender
+                    )
+                    handed_off = True
+                    self._enqueue(session_id, item)
+                    return
 
             # ── 同步回退路径：CLI ──
+            prompt = await asyncio.to_thread(self._build_prompt, item.sender, item.text)
             if self._client:
                 print(
                     f"[{datetime.now().isoformat()}] [SYNC] "
                     f"Server unavailable, falling back to CLI",
                     flush=True,
                 )
-            result = self._run_opencode_cli(prompt)
+            result = await self._run_opencode_cli(prompt)
 
             if result:
-                reply_callback(message_id, result)
+                await asyncio.to_thread(reply_callback, message_id, result)
                 print(
                     f"[{datetime.now().isoformat()}] [SYNC] Reply sent",
                     flush=True,
@@ -311,12 +771,17 @@ class OpenCodeProcessor:
                     flush=True,
                 )
                 if error_callback:
-                    error_callback(message_id, "AI 未返回任何内容，请稍后重试")
+                    await asyncio.to_thread(
+                        error_callback, message_id, "AI 未返回任何内容，请稍后重试"
+                    )
 
         except Exception as e:
             print(f"[{datetime.now().isoformat()}] Error: {e}", flush=True)
             if error_callback:
-                error_callback(message_id, f"处理失败: {e}")
+                await asyncio.to_thread(error_callback, message_id, f"处理失败: {e}")
+        finally:
+            if not handed_off:
+                self._release(item.sender)
 
     def _is_server_available(self) -> bool:
         if not self._client:
@@ -398,45 +863,68 @@ class OpenCodeProcessor:
         if not self._store:
             return text
 
-        keywords = re.findall(r"[\u4e00-\u9fff]|[a-zA-Z]{3,}", text.lower())
-
-        filtered_keywords = [
-            kw
-            for kw in keywords
-            if kw not in CHINESE_STOPWORDS and kw not in ENGLISH_STOPWORDS
-        ]
-
-        if not filtered_keywords:
-            return text
-
-        relevant_summaries = self._store.search_by_keywords(
-            filtered_keywords, user_id=sender
+        # 同一用户、同一组检索词的追问直接复用上次的结果
+        terms = query_terms(text)
+        key = (sender, self.config.memory_retrieval, frozenset(terms) or text)
+        version = (
+            self._store.summary_version(sender)
+            if hasattr(self._store, "summary_version")
+            else 0
         )
-
-        if not relevant_summaries:
+        context = self._context_cache.get(key, version)
+        cached = context is not None
+        if context is None:
+            relevant_summaries = self._retrieve_memories(sender, text)
+            context = self._assembler.assemble(relevant_summaries)
+            self._context_cache.put(key, version, context)
+
+        if not context.items:
             return text
-
-        memory_parts = []
-        for s in relevant_summaries:
-            title = s.get("title", "Untitled")
-            summary = s.get("summary", "")
-            memory_parts.append(f"### {title}\n{summary}")
-
-        memory_context = "\n\n".join(memory_parts)
         prompt = (
             f"[Memory Context from previous conversations]\n"
-            f"{memory_context}\n"
+            f"{context.text}\n"
             f"[End of Memory Context]\n\n"
             f"User Message: {text}"
         )
 
         print(
-            f"[{datetime.now().isoformat()}] Injected {len(relevant_summaries)} memories into prompt",
+            f"[{datetime.now().isoformat()}] Injected {context.items}/"
+            f"{context.candidates} memories (~{context.tokens} tokens) into prompt"
+            f"{' (cached)' if cached else ''}",
             flush=True,
         )
         return prompt
 
-    def _run_opencode_cli(self, prompt: str) -> str:
+    def _retrieve_memories(self, sender: str, text: str) -> list[dict[str, Any]]:
+        assert self._store is not None
+        k = self.config.memory_top_k
+        mode = self.config.memory_retrieval
+        if mode != "keyword" and not hasattr(self._store, "search_semantic"):
+            mode = "keyword"
+        keyword_hits: list[dict[str, Any]] = []
+        if mode != "semantic":
+            terms = list(query_terms(text))
+            if terms:
+                keyword_hits = self._store.search_by_keywords(
+                    terms, user_id=sender, limit=k
+                )
+        if mode == "keyword":
+            return keyword_hits
+        semantic_hits = self._store.search_semantic(text, user_id=sender, limit=k)
+        if mode == "semantic":
+            return semantic_hits
+        # hybrid：倒数排名融合，两路都靠前的摘要排在最前
+        fused: dict[str, float] = {}
+        entries: dict[str, dict[str, Any]] = {}
+        for hits in (keyword_hits, semantic_hits):
+            for rank, s in enumerate(hits):
+                sid = s["session_id"]
+                fused[sid] = fused.get(sid, 0.0) + 1.0 / (_RRF_K + rank + 1)
+                entries.setdefault(sid, s)
+        ranked = sorted(fused, key=lambda sid: -fused[sid])[:k]
+        return [{**entries[sid], "score": fused[sid]} for sid in ranked]
+
+    async def _run_opencode_cli(self, prompt: str) -> str:
         opencode_bin = _resolve_opencode_path(self.config.opencode_path)
         cmd = [
             opencode_bin,
@@ -446,18 +934,20 @@ class OpenCodeProcessor:
             prompt,
         ]
 
-        kwargs: dict[str, Any] = {
-            "capture_output": True,
-            "text": True,
-            "timeout": 1800,
-        }
-
-        if self.config.working_dir:
-            kwargs["cwd"] = self.config.working_dir
-
-        result = subprocess.run(cmd, **kwargs)
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.config.working_dir or None,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=1800)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise
 
-        if result.returncode != 0:
-            raise Exception(f"OpenCode failed: {result.stderr}")
+        if proc.returncode != 0:
+            raise Exception(f"OpenCode failed: {stderr.decode(errors='replace')}")
 
-        return result.stdout.strip()
+        return stdout.decode(errors="replace").strip()
@@ -0,0 +1,563 @@
+from __future__ import annotations
+
+import heapq
+import json
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+from .index import bm25_idf
+from .store import JsonStore, RetentionPolicy, _summary_text
+from .vector import Embedder, HashingEmbedder, VectorIndex
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_sessions (
+    open_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    session_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL DEFAULT '',
+    summary TEXT NOT NULL DEFAULT '',
+    keywords TEXT NOT NULL DEFAULT '[]',
+    user_id TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    search_text TEXT NOT NULL DEFAULT '',
+    cursor TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_summaries_user ON summaries (user_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_summaries_updated ON summaries (updated_at);
+CREATE TABLE IF NOT EXISTS summary_keywords (
+    keyword TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    PRIMARY KEY (keyword, session_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_summary_keywords_session
+    ON summary_keywords (session_id);
+CREATE TABLE IF NOT EXISTS session_owners (
+    session_id TEXT PRIMARY KEY,
+    open_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summary_tombstones (
+    session_id TEXT PRIMARY KEY,
+    cursor TEXT NOT NULL DEFAULT '{}'
+);
+"""
+
+_SUMMARY_COLUMNS = (
+    "session_id, title, summary, keywords, user_id, created_at, updated_at, cursor"
+)
+_JOINED_SUMMARY_COLUMNS = (
+    "s.session_id, s.title, s.summary, s.keywords, s.user_id, "
+    "s.created_at, s.updated_at, s.cursor"
+)
+
+
+def _default_db_path() -> Path:
+    return (
+        Path.home() / ".config" / "opencode" / "feishu_bot" / "data" / "store.sqlite3"
+    )
+
+
+class SqliteStore:
+    """SQLite-backed drop-in for :class:`JsonStore`.
+
+    The database runs in WAL mode so readers on other threads never wait for
+    a writer; each thread gets its own connection and writes are serialized
+    by a lock.
+    """
+
+    def __init__(
+        self, path: str | None = None, embedder: Embedder | None = None
+    ) -> None:
+        self._path = Path(path) if path is not None else _default_db_path()
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._conns: list[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        # 语义检索用的向量索引：首次检索时构建，常驻内存
+        self._vectors = VectorIndex(embedder or HashingEmbedder())
+        self._vectors_ready = False
+        self._vector_lock = threading.Lock()
+        self._vector_path = self._path.with_name(self._path.name + ".vec.npz")
+        self._versions: dict[str, int] = {}
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(summaries)")}
+        if "cursor" not in columns:
+            # 旧库补列
+            conn.execute(
+                "ALTER TABLE summaries ADD COLUMN cursor TEXT NOT NULL DEFAULT '{}'"
+            )
+        with conn:
+            # 旧库没有 session_owners，从当前会话和摘要归属补齐
+            conn.execute(
+                "INSERT OR IGNORE INTO session_owners (session_id, open_id) "
+                "SELECT session_id, open_id FROM user_sessions"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO session_owners (session_id, open_id) "
+                "SELECT session_id, user_id FROM summaries WHERE user_id != ''"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self._path), timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def close(self) -> None:
+        with self._vector_lock:
+            if self._vectors_ready:
+                try:
+                    self._vectors.save(self._vector_path)
+                except Exception as e:
+                    print(
+                        f"[{datetime.now().isoformat()}] vector cache save failed: {e}"
+                    )
+        with self._conns_lock:
+            for conn in self._conns:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._conns.clear()
+        self._local = threading.local()
+
+    @staticmethod
+    def _row_to_summary(row: sqlite3.Row) -> dict[str, Any]:
+        try:
+            keywords = json.loads(row["keywords"])
+        except (TypeError, json.JSONDecodeError):
+            keywords = []
+        result = {
+            "title": row["title"],
+            "summary": row["summary"],
+            "keywords": keywords,
+            "user_id": row["user_id"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+        cursor = SqliteStore._load_cursor(row["cursor"])
+        if cursor:
+            result["cursor"] = cursor
+        return result
+
+    @staticmethod
+    def _load_cursor(raw: str | None) -> dict[str, Any]:
+        try:
+            cursor = json.loads(raw or "{}")
+        except (TypeError, json.JSONDecodeError):
+            return {}
+        return cursor if isinstance(cursor, dict) else {}
+
+    def get_user_session(self, open_id: str) -> str | None:
+        row = (
+            self._conn()
+            .execute(
+                "SELECT session_id FROM user_sessions WHERE open_id = ?", (open_id,)
+            )
+            .fetchone()
+        )
+        return row["session_id"] if row is not None else None
+
+    def set_user_session(self, open_id: str, session_id: str) -> None:
+        conn = self._conn()
+        with self._write_lock, conn:
+            conn.execute(
+                "INSERT INTO user_sessions (open_id, session_id) VALUES (?, ?) "
+                "ON CONFLICT(open_id) DO UPDATE SET session_id = excluded.session_id",
+                (open_id, session_id),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO session_owners (session_id, open_id) "
+                "VALUES (?, ?)",
+                (session_id, open_id),
+            )
+
+    def get_all_user_sessions(self) -> dict[str, str]:
+        rows = self._conn().execute("SELECT open_id, session_id FROM user_sessions")
+        return {row["open_id"]: row["session_id"] for row in rows}
+
+    def get_session_owner(self, session_id: str) -> str | None:
+        row = (
+            self._conn()
+            .execute(
+                "SELECT open_id FROM session_owners WHERE session_id = ?",
+                (session_id,),
+            )
+            .fetchone()
+        )
+        return row["open_id"] if row is not None else None
+
+    def set_session_owner(self, session_id: str, open_id: str) -> None:
+        conn = self._conn()
+        with self._write_lock, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO session_owners (session_id, open_id) "
+                "VALUES (?, ?)",
+                (session_id, open_id),
+            )
+
+    def get_session_owners(self) -> dict[str, str]:
+        rows = self._conn().execute("SELECT session_id, open_id FROM session_owners")
+        return {row["session_id"]: row["open_id"] for row in rows}
+
+    def get_summary(self, session_id: str) -> dict[str, Any] | None:
+        row = (
+            self._conn()
+            .execute(
+                f"SELECT {_SUMMARY_COLUMNS} FROM summaries WHERE session_id = ?",
+                (session_id,),
+            )
+            .fetchone()
+        )
+        return self._row_to_summary(row) if row is not None else None
+
+    def set_summary(
+        self,
+        session_id: str,
+        title: str,
+        summary: str,
+        keywords: list[str],
+        user_id: str,
+        cursor: dict[str, Any] | None = None,
+        created_at: str | None = None,
+        updated_at: str | None = None,
+    ) -> None:
+        now = datetime.now().isoformat()
+        search_text = " ".join([title, summary, " ".join(keywords)]).lower()
+        conn = self._conn()
+        with self._write_lock, conn:
+            row = conn.execute(
+                "SELECT user_id FROM summaries WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            previous_user = row["user_id"] if row is not None else None
+            conn.execute(
+                "INSERT INTO summaries "
+                "(session_id, title, summary, keywords, user_id, created_at, "
+                "updated_at, search_text, cursor) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET "
+                "title = excluded.title, summary = excluded.summary, "
+                "keywords = excluded.keywords, user_id = excluded.user_id, "
+                "updated_at = excluded.updated_at, "
+                "search_text = excluded.search_text, cursor = excluded.cursor",
+                (
+                    session_id,
+                    title,
+                    summary,
+                    json.dumps(keywords, ensure_ascii=False),
+                    user_id,
+                    created_at or now,
+                    updated_at or now,
+                    search_text,
+                    json.dumps(cursor or {}),
+                ),
+            )
+            conn.execute(
+                "DELETE FROM summary_keywords WHERE session_id = ?", (session_id,)
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO summary_keywords (keyword, session_id) "
+                "VALUES (?, ?)",
+                [(kw, session_id) for kw in dict.fromkeys(keywords)],
+            )
+            conn.execute(
+                "DELETE FROM summary_tombstones WHERE session_id = ?", (session_id,)
+            )
+            if user_id:
+                conn.execute(
+                    "INSERT OR IGNORE INTO session_owners (session_id, open_id) "
+                    "VALUES (?, ?)",
+                    (session_id, user_id),
+                )
+        self._bump_version(user_id)
+        if previous_user is not None and previous_user != user_id:
+            self._bump_version(previous_user)
+        with self._vector_lock:
+            if self._vectors_ready:
+                text = _summary_text(
+                    {"title": title, "summary": summary, "keywords": keywords}
+                )
+                self._vectors.add(session_id, text, user_id, updated_at or now)
+
+    def _bump_version(self, user_id: str) -> None:
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def summary_version(self, user_id: str) -> int:
+        return self._versions.get(user_id, 0)
+
+    def get_summarized_session_ids(self) -> set[str]:
+        rows = self._conn().execute("SELECT session_id FROM summaries")
+        return {row["session_id"] for row in rows}
+
+    def get_summary_cursors(self) -> dict[str, dict[str, Any]]:
+        conn = self._conn()
+        cursors = {
+            row["session_id"]: self._load_cursor(row["cursor"])
+            for row in conn.execute("SELECT session_id, cursor FROM summary_tombstones")
+        }
+        for row in conn.execute("SELECT session_id, updated_at, cursor FROM summaries"):
+            cursors[row["session_id"]] = self._cursor_of(row)
+        return cursors
+
+    @staticmethod
+    def _cursor_of(row: sqlite3.Row) -> dict[str, Any]:
+        cursor = SqliteStore._load_cursor(row["cursor"])
+        if cursor:
+            return cursor
+        try:
+            ts = datetime.fromisoformat(row["updated_at"]).timestamp()
+        except (TypeError, ValueError):
+            ts = 0.0
+        return {"updated": ts * 1000.0}
+
+    def prune(
+        self,
+        policy: RetentionPolicy,
+        orphaned_user_sessions: dict[str, str] | None = None,
+    ) -> dict[str, int]:
+        """Same contract as :meth:`JsonStore.prune`.
+
+        Retrieval hits are not tracked here, so idleness is measured from
+        ``updated_at``.
+        """
+        now = datetime.now()
+        conds: list[str] = []
+        params: list[Any] = []
+        days = [d for d in (policy.max_age_days, policy.max_idle_days) if d]
+        if days:
+            conds.append("updated_at < ?")
+            params.append((now - timedelta(days=min(days))).isoformat())
+        if policy.max_per_user:
+            conds.append(
+                "session_id IN (SELECT session_id FROM (SELECT session_id, "
+                "ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY updated_at DESC) "
+                "AS rn FROM summaries) WHERE rn > ?)"
+            )
+            params.append(policy.max_per_user)
+        conn = self._conn()
+        with self._write_lock, conn:
+            victims: list[str] = []
+            reclaimed = 0
+            if conds:
+                rows = conn.execute(
+                    "SELECT session_id, user_id, updated_at, cursor, length(title) + "
+                    "length(summary) + length(keywords) + length(search_text) AS size "
+                    f"FROM summaries WHERE {' OR '.join(conds)}",
+                    params,
+                ).fetchall()
+                victims = [row["session_id"] for row in rows]
+                for user_id in {row["user_id"] for row in rows}:
+                    self._bump_version(user_id)
+                reclaimed = sum(row["size"] or 0 for row in rows)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO summary_tombstones (session_id, cursor) "
+                    "VALUES (?, ?)",
+                    [
+                        (row["session_id"], json.dumps(self._cursor_of(row)))
+                        for row in rows
+                    ],
+                )
+                conn.executemany(
+                    "DELETE FROM summaries WHERE session_id = ?",
+                    [(sid,) for sid in victims],
+                )
+                conn.executemany(
+                    "DELETE FROM summary_keywords WHERE session_id = ?",
+                    [(sid,) for sid in victims],
+                )
+            with self._vector_lock:
+                for sid in victims:
+                    self._vectors.remove(sid)
+            removed_sessions = 0
+            for open_id, sid in (orphaned_user_sessions or {}).items():
+                cur = conn.execute(
+                    "DELETE FROM user_sessions WHERE open_id = ? AND session_id = ?",
+                    (open_id, sid),
+                )
+                if cur.rowcount:
+                    conn.execute(
+                        "DELETE FROM session_owners WHERE session_id = ? "
+                        "AND open_id = ?",
+                        (sid, open_id),
+                    )
+                removed_sessions += cur.rowcount
+        return {
+            "summaries": len(victims),
+            "user_sessions": removed_sessions,
+            "bytes": reclaimed,
+        }
+
+    def keyword_idf(self, terms: list[str]) -> dict[str, float]:
+        conn = self._conn()
+        n = conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        if n == 0 or not terms:
+            return {}
+        placeholders = ", ".join("?" for _ in terms)
+        df = {
+            row["keyword"]: row["df"]
+            for row in conn.execute(
+                "SELECT keyword, COUNT(*) AS df FROM summary_keywords "
+                f"WHERE keyword IN ({placeholders}) GROUP BY keyword",
+                terms,
+            )
+        }
+        return {t: bm25_idf(df.get(t, 0), n) for t in terms}
+
+    def search_by_keywords(
+        self, keywords: list[str], user_id: str | None = None, limit: int = 10
+    ) -> list[dict[str, Any]]:
+        weights = Counter(keywords)
+        if not weights:
+            return []
+        placeholders = ", ".join("?" for _ in weights)
+        sql = (
+            f"SELECT k.keyword, {_JOINED_SUMMARY_COLUMNS} "
+            f"FROM summary_keywords k JOIN summaries s ON s.session_id = k.session_id "
+            f"WHERE k.keyword IN ({placeholders})"
+        )
+        params: list[Any] = list(weights)
+        if user_id is not None:
+            sql += " AND s.user_id = ?"
+            params.append(user_id)
+        scores: dict[str, int] = {}
+        rows: dict[str, sqlite3.Row] = {}
+        for row in self._conn().execute(sql, params):
+            sid = row["session_id"]
+            scores[sid] = scores.get(sid, 0) + weights[row["keyword"]]
+            rows[sid] = row
+        ranked = heapq.nlargest(
+            limit,
+            scores,
+            key=lambda sid: (scores[sid], rows[sid]["updated_at"] or ""),
+        )
+        results: list[dict[str, Any]] = []
+        for sid in ranked:
+            entry = self._row_to_summary(rows[sid])
+            entry["session_id"] = sid
+            entry["score"] = float(scores[sid])
+            results.append(entry)
+        return results
+
+    def _ensure_vector_index(self) -> None:
+        if self._vectors_ready:
+            return
+        with self._vector_lock:
+            if self._vectors_ready:
+                return
+            try:
+                self._vectors.load(self._vector_path)
+            except Exception as e:
+                print(f"[{datetime.now().isoformat()}] vector cache unreadable: {e}")
+            rows = {
+                row["session_id"]: row
+                for row in self._conn().execute(
+                    f"SELECT {_SUMMARY_COLUMNS} FROM summaries"
+                )
+            }
+            for sid in [sid for sid in self._vectors.ids() if sid not in rows]:
+                self._vectors.remove(sid)
+            self._vectors.add_many(
+                [
+                    (
+                        sid,
+                        _summary_text(self._row_to_summary(row)),
+                        row["user_id"],
+                        row["updated_at"],
+                    )
+                    for sid, row in rows.items()
+                    if self._vectors.stamp(sid) != row["updated_at"]
+                ]
+            )
+            self._vectors_ready = True
+
+    def search_semantic(
+        self, query: str, user_id: str | None = None, limit: int = 10
+    ) -> list[dict[str, Any]]:
+        self._ensure_vector_index()
+        with self._vector_lock:
+            scores = self._vectors.search(query, user_id, limit)
+        if not scores:
+            return []
+        placeholders = ", ".join("?" for _ in scores)
+        rows = self._conn().execute(
+            f"SELECT {_SUMMARY_COLUMNS} FROM summaries "
+            f"WHERE session_id IN ({placeholders})",
+            list(scores),
+        )
+        results: list[dict[str, Any]] = []
+        for row in rows:
+            entry = self._row_to_summary(row)
+            entry["session_id"] = row["session_id"]
+            entry["score"] = scores[row["session_id"]]
+            results.append(entry)
+        results.sort(
+            key=lambda e: (scores[e["session_id"]], e["updated_at"] or ""),
+            reverse=True,
+        )
+        return results
+
+    def search_by_text(
+        self, query: str, user_id: str | None = None, limit: int = 10
+    ) -> list[dict[str, Any]]:
+        sql = f"SELECT {_SUMMARY_COLUMNS} FROM summaries WHERE instr(search_text, ?) > 0"
+        params: list[Any] = [query.lower()]
+        if user_id is not None:
+            sql += " AND user_id = ?"
+            params.append(user_id)
+        sql += " ORDER BY updated_at DESC LIMIT ?"
+        params.append(limit)
+        results: list[dict[str, Any]] = []
+        for row in self._conn().execute(sql, params):
+            entry = self._row_to_summary(row)
+            entry["session_id"] = row["session_id"]
+            results.append(entry)
+        return results
+
+
+def migrate_json_store(json_path: str, store: SqliteStore) -> int:
+    """Copy every user session and summary from a ``store.json`` into *store*.
+
+    Returns the number of summaries migrated.
+    """
+    src = JsonStore(json_path)
+    for session_id, open_id in src.get_session_owners().items():
+        store.set_session_owner(session_id, open_id)
+    for open_id, session_id in src.get_all_user_sessions().items():
+        store.set_user_session(open_id, session_id)
+    count = 0
+    for session_id in src.get_summarized_session_ids():
+        s = src.get_summary(session_id)
+        if s is None:
+            continue
+        store.set_summary(
+            session_id,
+            s.get("title", ""),
+            s.get("summary", ""),
+            list(s.get("keywords", [])),
+            s.get("user_id", ""),
+            cursor=s.get("cursor"),
+            created_at=s.get("created_at"),
+            updated_at=s.get("updated_at"),
+        )
+        count += 1
+    print(
+        f"[{datetime.now().isoformat()}] migrated {count} summaries from {json_path}"
+    )
+    return count
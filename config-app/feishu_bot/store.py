@@ -1,265 +1,180 @@
 from __future__ import annotations
 
+import atexit
+import heapq
 import json
 import os
-import re
+import queue
 import tempfile
 import threading
 import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Any
-
-
-CHINESE_STOPWORDS: set[str] = {
-    "的",
-    "了",
-    "是",
-    "在",
-    "我",
-    "有",
-    "和",
-    "就",
-    "不",
-    "人",
-    "都",
-    "一",
-    "这",
-    "中",
-    "大",
-    "为",
-    "上",
-    "个",
-    "国",
-    "到",
-    "说",
-    "们",
-    "以",
-    "会",
-    "着",
-    "来",
-    "对",
-    "要",
-    "也",
-    "能",
-    "下",
-    "过",
-    "子",
-    "地",
-    "多",
-    "后",
-    "然",
-    "于",
-    "心",
-    "学",
-    "么",
-    "之",
-    "用",
-    "发",
-    "天",
-    "如",
-    "出",
-    "把",
-    "好",
-    "没",
-    "成",
-    "只",
-    "事",
-    "那",
-    "还",
-    "被",
-    "做",
-    "可",
-    "她",
-    "吧",
-    "最",
-    "但",
-    "他",
-    "它",
-    "你",
-    "很",
-    "看",
-    "得",
-    "去",
-    "又",
-    "让",
-    "给",
-    "从",
-    "想",
-    "与",
-    "而",
-    "等",
-    "比",
-    "其",
-    "更",
-    "已",
-    "所",
-    "同",
-    "日",
-    "手",
-    "行",
-    "前",
-    "无",
-    "动",
-    "方",
-    "问",
-    "应",
-    "新",
-    "间",
-    "两",
-    "次",
-    "些",
-    "什",
-    "当",
-    "经",
-    "头",
-    "起",
-    "第",
-    "公",
-    "此",
-    "工",
-    "使",
-    "情",
-    "感",
-    "种",
-    "面",
-    "别",
-    "开",
-    "门",
-    "回",
-    "话",
-    "该",
-    "并",
-    "进",
-    "正",
-    "向",
-    "关",
-    "点",
-    "长",
-}
+from typing import IO, Any, Callable, Iterable, Iterator
 
-ENGLISH_STOPWORDS: set[str] = {
-    "the",
-    "a",
-    "an",
-    "is",
-    "are",
-    "was",
-    "were",
-    "be",
-    "been",
-    "being",
-    "have",
-    "has",
-    "had",
-    "do",
-    "does",
-    "did",
-    "will",
-    "would",
-    "shall",
-    "should",
-    "may",
-    "might",
-    "can",
-    "could",
-    "must",
-    "need",
-    "dare",
-    "ought",
-    "used",
-    "to",
-    "of",
-    "in",
-    "for",
-    "on",
-    "with",
-    "at",
-    "by",
-    "from",
-    "as",
-    "into",
-    "through",
-    "during",
-    "before",
-    "after",
-    "above",
-    "below",
-    "between",
-    "out",
-    "off",
-    "over",
-    "under",
-    "again",
-    "further",
-    "then",
-    "once",
-    "here",
-    "there",
-    "when",
-    "where",
-    "why",
-    "how",
-    "all",
-    "both",
-    "each",
-    "few",
-    "more",
-    "most",
-    "other",
-    "some",
-    "such",
-    "no",
-    "nor",
-    "not",
-    "only",
-    "own",
-    "same",
-    "so",
-    "than",
-    "too",
-    "very",
-    "just",
-    "because",
-    "but",
-    "and",
-    "or",
-    "if",
-    "while",
-    "that",
-    "this",
-    "it",
-    "its",
-    "i",
-    "me",
-    "my",
-    "we",
-    "our",
-    "you",
-    "your",
-    "he",
-    "him",
-    "his",
-    "she",
-    "her",
-    "they",
-    "them",
-    "their",
-    "what",
-    "which",
-    "who",
-    "whom",
-}
+from .codec import SnapshotFormatError, decode_snapshot, get_codec
+from .index import KeywordIndex, TextIndex, bm25_idf
+from .summarizer import ExtractiveSummarizer, Summarizer
+from .tokenizer import (
+    CHINESE_STOPWORDS,
+    ENGLISH_STOPWORDS,
+    extract_keywords,
+    tokenize_text,
+)
+from .vector import Embedder, HashingEmbedder, VectorIndex
 
 _DEFAULT_DATA: dict[str, Any] = {
     "user_sessions": {},
     "summaries": {},
     "keyword_index": {},
+    # 被淘汰摘要的水位线，防止扫描把它们重新总结回来
+    "tombstones": {},
+    # 现存摘要的水位线，随 manifest 保存，扫描时不必加载分片
+    "cursors": {},
+    # session_id -> open_id，包括用户切换走的历史会话
+    "session_owners": {},
 }
 
+_WAL_COMPACT_THRESHOLD = 1000
+
+_SHARD_MANIFEST = "manifest"
+_SUMMARY_MAX_CHARS = 2000
+_INCREMENTAL_LIMIT = 200
+
+# 写线程队列中的控制标记（flush 请求以 threading.Event 入队）
+_COMPACT = "compact"
+_STOP = "stop"
+
+
+@dataclass
+class RetentionPolicy:
+    """Limits applied by the memory pruning job; 0 disables a limit."""
+
+    max_per_user: int = 0
+    max_age_days: float = 0.0
+    max_idle_days: float = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_per_user or self.max_age_days or self.max_idle_days)
+
+
+def _parse_ts(value: str | None) -> float:
+    if not value:
+        return 0.0
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _summary_cursor(s: dict[str, Any]) -> dict[str, Any]:
+    return s.get("cursor") or {"updated": _parse_ts(s.get("updated_at")) * 1000.0}
+
+
+def _shard_of(user_id: str, shards: int) -> int:
+    return zlib.crc32(user_id.encode("utf-8")) % shards
+
+
+def _session_updated(session: dict[str, Any]) -> float:
+    try:
+        return float(session.get("time", {}).get("updated") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _message_id(message: Any) -> str:
+    if not isinstance(message, dict):
+        return ""
+    info = message.get("info")
+    if isinstance(info, dict) and info.get("id"):
+        return str(info["id"])
+    return str(message.get("id", ""))
+
+
+def _summary_text(s: dict[str, Any]) -> str:
+    return " ".join(
+        [s.get("title", ""), s.get("summary", ""), " ".join(s.get("keywords", []))]
+    )
+
+
+class _RWLock:
+    """Writer-preferring readers-writer lock."""
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
 
 class JsonStore:
-    def __init__(self, path: str | None = None) -> None:
+    """JSON-file store for user sessions and session summaries.
+
+    Mutations are applied in memory under a short write lock and persisted by
+    a background writer thread, so callers never wait on disk I/O. Searches
+    share a read lock; ``user_sessions`` is copy-on-write and read lock-free.
+    With ``durability="batched"`` the writer group-commits everything queued
+    within ``flush_interval`` seconds (or ``flush_batch`` records) into one
+    disk write; ``durability="sync"`` makes each mutation wait for its fsync.
+
+    With ``journal=True`` each mutation is appended as one compact record to
+    ``<store>.wal`` instead of rewriting the whole snapshot; the journal is
+    folded back into the snapshot by the writer once it holds
+    ``compact_threshold`` records, and replayed on load.
+
+    With ``shards > 0`` summaries are hash-bucketed by user into
+    ``<store>.d/shard-NNN`` files next to a small ``manifest`` holding
+    ``user_sessions`` and the session -> shard map. Shards load lazily on
+    first access and a flush only rewrites the shards that changed.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        journal: bool = False,
+        compact_threshold: int = _WAL_COMPACT_THRESHOLD,
+        durability: str = "batched",
+        flush_interval: float = 0.2,
+        flush_batch: int = 100,
+        codec: str = "auto",
+        shards: int = 0,
+        embedder: Embedder | None = None,
+    ) -> None:
         if path is None:
             path = str(
                 Path.home()
@@ -271,41 +186,607 @@ class JsonStore:
             )
         self._path = Path(path)
         self._path.parent.mkdir(parents=True, exist_ok=True)
-        self._lock = threading.Lock()
+        self._wal_path = self._path.with_name(self._path.name + ".wal")
+        # 压缩进行中的旧日志段：快照落盘成功后才删除
+        self._wal_old_path = self._path.with_name(self._path.name + ".wal.1")
+        self._journal = journal
+        self._compact_threshold = max(1, compact_threshold)
+        if durability not in ("sync", "batched"):
+            raise ValueError(f"unknown durability: {durability}")
+        # sync：每次写入都等 fsync 完成才返回；batched：后台合并提交
+        self._sync = durability == "sync"
+        self._flush_interval = 0.0 if self._sync else max(0.0, flush_interval)
+        self._flush_batch = max(1, flush_batch)
+        # 快照编码；读取时按内容自动识别格式，切换编码无需迁移
+        self._codec = get_codec(codec)
+        self._rwlock = _RWLock()
+        self._queue: queue.Queue[dict[str, Any] | str] = queue.Queue()
+        self._closed = False
+        self._wal: IO[str] | None = None
+        self._wal_records = 0
+        self._index = KeywordIndex()
+        # 按用户分区的 session 集合，检索时只触及该用户自己的摘要
+        self._by_user: dict[str, set[str]] = {}
+        # 全文索引在首次检索时才构建，避免拖慢启动
+        self._text_index = TextIndex(tokenize_text)
+        self._text_index_ready = False
+        # 向量索引同样延迟构建；向量缓存在 <store>.vec.npz，避免重复 embedding
+        self._vectors = VectorIndex(embedder or HashingEmbedder())
+        self._vectors_ready = False
+        self._vector_path = self._path.with_name(self._path.name + ".vec.npz")
+        # 每个用户摘要的修改计数，供上层缓存判断是否失效
+        self._versions: dict[str, int] = {}
+        # 最近一次被检索命中的时间，仅保存在内存中，用于 LRU 淘汰
+        self._last_access: dict[str, float] = {}
+        self._shards = max(0, shards)
+        self._shard_dir = self._path.with_name(self._path.name + ".d")
+        self._loaded_shards: set[int] = set()
+        self._shard_sessions: dict[int, set[str]] = {}
+        self._session_shard: dict[str, int] = {}
+        self._dirty_shards: set[int] = set()
+        self._manifest_dirty = False
+        # 旧 manifest 没有 cursors 字段，首次扫描时需加载全部分片补齐
+        self._cursors_complete = True
+        if self._shards:
+            self._shard_dir.mkdir(parents=True, exist_ok=True)
         self._data = self._load()
+        if self._journal:
+            self._wal = open(self._wal_path, "a", encoding="utf-8")
+        if (self._wal_records and not self._journal) or (
+            self._shards and self._manifest_dirty
+        ):
+            # 非日志模式下遗留的 WAL，或刚从单文件迁移到分片：先落一次快照
+            self._flush()
+            if not self._journal:
+                self._remove_wal_files()
+        self._writer = threading.Thread(
+            target=self._write_loop, name="store-writer", daemon=True
+        )
+        self._writer.start()
+        atexit.register(self.close)
 
     def _load(self) -> dict[str, Any]:
+        data: dict[str, Any] | None = None
+        manifest = self._shard_dir / _SHARD_MANIFEST
         try:
-            if self._path.exists():
-                with open(self._path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
+            if self._shards and manifest.exists():
+                data = self._load_manifest(manifest)
+            elif self._path.exists():
+                with open(self._path, "rb") as f:
+                    data = decode_snapshot(f.read())
                 for key in _DEFAULT_DATA:
                     if key not in data:
-                        data[key] = _DEFAULT_DATA[key]
-                return data
+                        data[key] = dict(_DEFAULT_DATA[key])
+                if self._shards:
+                    self._migrate_to_shards(data)
+        except (ImportError, SnapshotFormatError):
+            # 缺少解码依赖或格式不认识时不能当作空库，否则下次落盘会覆盖原数据
+            raise
         except Exception:
             print(
                 f"[{datetime.now().isoformat()}] store.json corrupt or unreadable, resetting"
             )
-        return json.loads(json.dumps(_DEFAULT_DATA))
+            data = None
+        if data is None:
+            data = json.loads(json.dumps(_DEFAULT_DATA))
+            self._loaded_shards = set(range(self._shards))
+        # 倒排索引以 summaries 为准重建，快照里的 keyword_index 仅作兼容
+        data.pop("keyword_index", None)
+        self._data = data
+        owners = data["session_owners"]
+        for open_id, sid in data["user_sessions"].items():
+            owners.setdefault(sid, open_id)
+        for sid, s in data["summaries"].items():
+            self._index_summary(sid, s)
+        for wal_path in (self._wal_old_path, self._wal_path):
+            self._wal_records += self._replay(data, wal_path)
+        return data
+
+    def _load_manifest(self, path: Path) -> dict[str, Any]:
+        manifest = decode_snapshot(path.read_bytes())
+        shards = int(manifest.get("shards", self._shards))
+        if shards != self._shards:
+            print(
+                f"[{datetime.now().isoformat()}] store has {shards} shards, "
+                f"ignoring configured {self._shards}"
+            )
+            self._shards = shards
+        self._session_shard = dict(manifest.get("sessions", {}))
+        for sid, bucket in self._session_shard.items():
+            self._shard_sessions.setdefault(bucket, set()).add(sid)
+        if "cursors" not in manifest and self._session_shard:
+            self._cursors_complete = False
+        return {
+            "user_sessions": dict(manifest.get("user_sessions", {})),
+            "summaries": {},
+            "tombstones": dict(manifest.get("tombstones", {})),
+            "cursors": dict(manifest.get("cursors", {})),
+            "session_owners": dict(manifest.get("session_owners", {})),
+        }
+
+    def _migrate_to_shards(self, data: dict[str, Any]) -> None:
+        for sid, s in data["summaries"].items():
+            bucket = _shard_of(s.get("user_id", ""), self._shards)
+            self._session_shard[sid] = bucket
+            self._shard_sessions.setdefault(bucket, set()).add(sid)
+            self._dirty_shards.add(bucket)
+        self._loaded_shards = set(range(self._shards))
+        self._manifest_dirty = True
+        print(
+            f"[{datetime.now().isoformat()}] migrating {len(data['summaries'])} "
+            f"summaries into {self._shards} shards"
+        )
+
+    def _shard_path(self, bucket: int) -> Path:
+        return self._shard_dir / f"shard-{bucket:03d}"
+
+    def _load_shard(self, bucket: int) -> None:
+        """Load one shard into memory. Caller holds the write lock."""
+        if bucket in self._loaded_shards:
+            return
+        self._loaded_shards.add(bucket)
+        path = self._shard_path(bucket)
+        if not path.exists():
+            return
+        try:
+            payload = decode_snapshot(path.read_bytes())
+        except (ImportError, SnapshotFormatError):
+            self._loaded_shards.discard(bucket)
+            raise
+        except Exception as e:
+            print(f"[{datetime.now().isoformat()}] shard {bucket} unreadable: {e}")
+            return
+        summaries = self._data["summaries"]
+        for sid, s in payload.get("summaries", {}).items():
+            if sid in summaries:
+                continue
+            summaries[sid] = s
+            self._index_summary(sid, s)
+
+    def _ensure_shards(self, buckets: Iterable[int]) -> None:
+        missing = [b for b in buckets if b not in self._loaded_shards]
+        if not missing:
+            return
+        with self._rwlock.write():
+            for bucket in missing:
+                self._load_shard(bucket)
+
+    def _shards_for(self, user_id: str | None) -> Iterable[int]:
+        if not self._shards:
+            return ()
+        if user_id is None:
+            return range(self._shards)
+        return (_shard_of(user_id, self._shards),)
+
+    def _index_summary(self, session_id: str, value: dict[str, Any]) -> None:
+        user_id = value.get("user_id", "")
+        if user_id:
+            # 旧数据没有 session_owners，从摘要归属补齐
+            self._data["session_owners"].setdefault(session_id, user_id)
+        self._by_user.setdefault(user_id, set()).add(session_id)
+        self._data["cursors"][session_id] = _summary_cursor(value)
+        self._index.add(session_id, value.get("keywords", []), user_id)
+        if self._text_index_ready:
+            self._text_index.add(session_id, _summary_text(value), user_id)
+        if self._vectors_ready:
+            stamp = value.get("updated_at", "")
+            if self._vectors.stamp(session_id) != stamp:
+                self._vectors.add(session_id, _summary_text(value), user_id, stamp)
+
+    def _replay(self, data: dict[str, Any], wal_path: Path) -> int:
+        if not wal_path.exists():
+            return 0
+        count = 0
+        # 最后一条完整记录（以换行结尾）之后的字节偏移
+        complete = 0
+        try:
+            with open(wal_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # 崩溃时写了一半的尾部记录，丢弃
+                        break
+                    complete += len(line)
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._apply(data, record)
+                    count += 1
+            if complete < wal_path.stat().st_size:
+                # 截掉残缺的尾部，否则之后追加的记录会接在它后面一起被丢弃
+                with open(wal_path, "r+b") as f:
+                    f.truncate(complete)
+                    os.fsync(f.fileno())
+                print(
+                    f"[{datetime.now().isoformat()}] truncated torn record "
+                    f"at end of {wal_path}"
+                )
+        except Exception as e:
+            print(f"[{datetime.now().isoformat()}] wal replay failed ({wal_path}): {e}")
+        return count
+
+    def _apply(self, data: dict[str, Any], record: dict[str, Any]) -> None:
+        op = record.get("op")
+        if op == "user_session":
+            # 整体替换而非原地修改，无锁读者总能看到完整的字典
+            data["user_sessions"] = {
+                **data["user_sessions"],
+                record["open_id"]: record["session_id"],
+            }
+            data["session_owners"][record["session_id"]] = record["open_id"]
+            self._manifest_dirty = True
+        elif op == "summary":
+            session_id = record["session_id"]
+            value = record["value"]
+            if self._shards:
+                self._move_to_shard(session_id, value.get("user_id", ""))
+            old = data["summaries"].get(session_id)
+            if old is not None:
+                self._by_user.get(old.get("user_id", ""), set()).discard(session_id)
+                self._bump_version(old.get("user_id", ""))
+            self._bump_version(value.get("user_id", ""))
+            data["summaries"][session_id] = value
+            self._index_summary(session_id, value)
+            data["tombstones"].pop(session_id, None)
+            if self._shards:
+                self._manifest_dirty = True
+        elif op == "delete_summary":
+            session_id = record["session_id"]
+            if self._shards:
+                bucket = self._session_shard.get(session_id)
+                if bucket is not None:
+                    # 先加载再删除，否则稍后加载分片会把它带回来
+                    self._load_shard(bucket)
+                    del self._session_shard[session_id]
+                    self._shard_sessions[bucket].discard(session_id)
+                    self._dirty_shards.add(bucket)
+                    self._manifest_dirty = True
+            old = data["summaries"].pop(session_id, None)
+            if old is not None:
+                self._by_user.get(old.get("user_id", ""), set()).discard(session_id)
+                self._bump_version(old.get("user_id", ""))
+                data["tombstones"][session_id] = _summary_cursor(old)
+            data["cursors"].pop(session_id, None)
+            self._index.remove(session_id)
+            self._text_index.remove(session_id)
+            self._vectors.remove(session_id)
+            self._last_access.pop(session_id, None)
+        elif op == "delete_user_session":
+            # 只有会话已不存在时才会删除映射，归属记录一并清掉
+            old_sid = data["user_sessions"].get(record["open_id"])
+            if data["session_owners"].get(old_sid) == record["open_id"]:
+                del data["session_owners"][old_sid]
+            data["user_sessions"] = {
+                k: v for k, v in data["user_sessions"].items() if k != record["open_id"]
+            }
+            self._manifest_dirty = True
+
+    def _bump_version(self, user_id: str) -> None:
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def _move_to_shard(self, session_id: str, user_id: str) -> None:
+        """Load the session's old and new shards and record its placement."""
+        old = self._session_shard.get(session_id)
+        new = _shard_of(user_id, self._shards)
+        if old is not None:
+            self._load_shard(old)
+        self._load_shard(new)
+        if old != new:
+            if old is not None:
+                self._shard_sessions[old].discard(session_id)
+                self._dirty_shards.add(old)
+            self._session_shard[session_id] = new
+            self._shard_sessions.setdefault(new, set()).add(session_id)
+            self._manifest_dirty = True
+        self._dirty_shards.add(new)
+
+    def _ensure_text_index(self) -> None:
+        """Build the full-text index on first use."""
+        if self._text_index_ready:
+            return
+        with self._rwlock.write():
+            if self._text_index_ready:
+                return
+            self._build_text_index()
+
+    def _ensure_vector_index(self) -> None:
+        """Load cached vectors and embed whatever changed since they were saved."""
+        if self._vectors_ready:
+            return
+        with self._rwlock.write():
+            if self._vectors_ready:
+                return
+            try:
+                self._vectors.load(self._vector_path)
+            except Exception as e:
+                print(f"[{datetime.now().isoformat()}] vector cache unreadable: {e}")
+            summaries = self._data["summaries"]
+            known = summaries.keys() | self._session_shard.keys()
+            for sid in [sid for sid in self._vectors.ids() if sid not in known]:
+                self._vectors.remove(sid)
+            self._vectors.add_many(
+                [
+                    (sid, _summary_text(s), s.get("user_id", ""), stamp)
+                    for sid, s in summaries.items()
+                    if self._vectors.stamp(sid) != (stamp := s.get("updated_at", ""))
+                ]
+            )
+            self._vectors_ready = True
+
+    def _build_text_index(self) -> None:
+        for sid, s in self._data["summaries"].items():
+            self._text_index.add(sid, _summary_text(s), s.get("user_id", ""))
+        self._text_index_ready = True
+
+    def _snapshot_files(self) -> list[tuple[int | str, Path, dict[str, Any]]]:
+        """Copy everything that needs writing. Caller holds the read lock.
+
+        Returns ``(key, path, state)`` triples; ``key`` is the shard number
+        or ``"manifest"`` so a failed write can be marked dirty again. Only
+        the containers are copied; summaries are replaced rather than
+        modified in place, so :meth:`_write_files` can encode them after the
+        lock is released.
+        """
+        if not self._shards:
+            return [("snapshot", self._path, self._snapshot())]
+        summaries = self._data["summaries"]
+        files: list[tuple[int | str, Path, dict[str, Any]]] = []
+        for bucket in sorted(self._dirty_shards):
+            shard = {
+                sid: summaries[sid]
+                for sid in self._shard_sessions.get(bucket, ())
+                if sid in summaries
+            }
+            files.append((bucket, self._shard_path(bucket), {"summaries": shard}))
+        if self._manifest_dirty:
+            # manifest 最后写：先有分片内容，再让 manifest 指向它
+            files.append(
+                (
+                    _SHARD_MANIFEST,
+                    self._shard_dir / _SHARD_MANIFEST,
+                    {
+                        "shards": self._shards,
+                        "user_sessions": self._data["user_sessions"],
+                        "sessions": dict(self._session_shard),
+                        "tombstones": dict(self._data["tombstones"]),
+                        "cursors": dict(self._data["cursors"]),
+                        "session_owners": dict(self._data["session_owners"]),
+                    },
+                )
+            )
+        self._dirty_shards.clear()
+        self._manifest_dirty = False
+        return files
+
+    def _write_files(self, files: list[tuple[int | str, Path, dict[str, Any]]]) -> bool:
+        """Encode and write a :meth:`_snapshot_files` result, without any lock."""
+        failed = [
+            key
+            for key, path, state in files
+            if not self._write_snapshot(self._codec.encode(state), path)
+        ]
+        if failed and self._shards:
+            with self._rwlock.write():
+                for key in failed:
+                    if key == _SHARD_MANIFEST:
+                        self._manifest_dirty = True
+                    elif isinstance(key, int):
+                        self._dirty_shards.add(key)
+        return not failed
+
+    def _top_results(self, scores: dict[str, float], k: int) -> list[dict[str, Any]]:
+        summaries = self._data["summaries"]
+        top = heapq.nlargest(
+            k,
+            (sid for sid in scores if sid in summaries),
+            key=lambda sid: (scores[sid], summaries[sid].get("updated_at", "") or ""),
+        )
+        now = time.time()
+        results: list[dict[str, Any]] = []
+        for sid in top:
+            self._last_access[sid] = now
+            entry = dict(summaries[sid])
+            entry["session_id"] = sid
+            entry["score"] = scores[sid]
+            results.append(entry)
+        return results
+
+    def _last_used(self, session_id: str) -> float:
+        s = self._data["summaries"][session_id]
+        return max(
+            self._last_access.get(session_id, 0.0), _parse_ts(s.get("updated_at"))
+        )
+
+    def _snapshot(self) -> dict[str, Any]:
+        # user_sessions 整体替换，其余容器复制一层；编码在锁外进行
+        return {
+            "user_sessions": self._data["user_sessions"],
+            "summaries": dict(self._data["summaries"]),
+            "keyword_index": self._index.to_dict(),
+            "tombstones": dict(self._data["tombstones"]),
+            "session_owners": dict(self._data["session_owners"]),
+        }
+
+    def _mutate(self, record: dict[str, Any]) -> None:
+        """Apply a mutation record in memory and queue it for the writer.
+
+        Caller holds the write lock, so queue order matches apply order.
+        """
+        self._apply(self._data, record)
+        self._queue.put(record)
+
+    def _next_batch(self) -> list[Any]:
+        """Block for the next item, then group-commit.
+
+        Keeps collecting until ``flush_interval`` has passed since the first
+        item, ``flush_batch`` records are pending, or a control item
+        (flush/compact/stop) arrives.
+        """
+        batch: list[Any] = [self._queue.get()]
+        deadline = time.monotonic() + self._flush_interval
+        records = 1 if isinstance(batch[0], dict) else 0
+        while records == len(batch) and records < self._flush_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = (
+                    self._queue.get(timeout=timeout)
+                    if timeout > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            batch.append(item)
+            if isinstance(item, dict):
+                records += 1
+        return batch
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = self._next_batch()
+            records = [item for item in batch if isinstance(item, dict)]
+            try:
+                if records:
+                    if self._journal:
+                        self._append(records)
+                    else:
+                        self._flush()
+                if _COMPACT in batch or (
+                    self._journal and self._wal_records >= self._compact_threshold
+                ):
+                    self._compact()
+            except Exception as e:
+                print(f"[{datetime.now().isoformat()}] store writer error: {e}")
+            finally:
+                for item in batch:
+                    if isinstance(item, threading.Event):
+                        item.set()
+                    self._queue.task_done()
+            if _STOP in batch:
+                return
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Block until every mutation made so far is on disk."""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _append(self, records: list[dict[str, Any]]) -> None:
+        """Append records to the journal with a single fsync. Writer thread only."""
+        if self._wal is None:
+            return
+        lines = "".join(
+            json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n"
+            for r in records
+        )
+        try:
+            self._wal.write(lines)
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+        except Exception as e:
+            print(f"[{datetime.now().isoformat()}] wal append failed: {e}")
+            return
+        self._wal_records += len(records)
+
+    def compact(self) -> None:
+        """Ask the writer thread to fold the journal into the snapshot file."""
+        if self._journal:
+            self._queue.put(_COMPACT)
+
+    def _compact(self) -> None:
+        """Writer thread only.
+
+        The journal is rotated before the snapshot is taken, so the rotated
+        segment is always covered by the snapshot; records queued meanwhile
+        land in the new journal and replay idempotently on top of it.
+        """
+        if not self._journal or self._wal is None:
+            return
+        if (
+            not self._wal_records
+            and not self._wal_old_path.exists()
+            and not self._dirty_shards
+            and not self._manifest_dirty
+        ):
+            # 自上次快照以来没有任何变更，不必重写
+            return
+        try:
+            self._wal.close()
+            if self._wal_old_path.exists():
+                # 上一次压缩未完成：把当前日志接到旧段后面
+                with open(self._wal_path, "r", encoding="utf-8") as src:
+                    with open(self._wal_old_path, "a", encoding="utf-8") as dst:
+                        dst.write(src.read())
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                os.unlink(self._wal_path)
+            elif self._wal_path.exists():
+                os.replace(self._wal_path, self._wal_old_path)
+        except Exception as e:
+            print(f"[{datetime.now().isoformat()}] wal rotate failed: {e}")
+        finally:
+            self._wal = open(self._wal_path, "a", encoding="utf-8")
+            self._wal_records = 0
+        with self._rwlock.read():
+            files = self._snapshot_files()
+        if self._write_files(files):
+            try:
+                os.unlink(self._wal_old_path)
+            except FileNotFoundError:
+                pass
+
+    def close(self) -> None:
+        """Drain pending writes, compact the journal and stop the writer."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._vectors_ready:
+            try:
+                with self._rwlock.read():
+                    self._vectors.save(self._vector_path)
+            except Exception as e:
+                print(f"[{datetime.now().isoformat()}] vector cache save failed: {e}")
+        self.compact()
+        self._queue.put(_STOP)
+        self._writer.join()
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+
+    def _remove_wal_files(self) -> None:
+        for wal_path in (self._wal_old_path, self._wal_path):
+            try:
+                os.unlink(wal_path)
+            except FileNotFoundError:
+                pass
+        self._wal_records = 0
 
     def _flush(self) -> None:
-        dir_path = str(self._path.parent)
+        with self._rwlock.read():
+            files = self._snapshot_files()
+        self._write_files(files)
+
+    def _write_snapshot(self, payload: bytes, path: Path) -> bool:
+        dir_path = str(path.parent)
         tmp_path: str | None = None
         try:
             fd = tempfile.NamedTemporaryFile(
-                mode="w",
+                mode="wb",
                 dir=dir_path,
                 suffix=".tmp",
                 delete=False,
-                encoding="utf-8",
             )
             tmp_path = fd.name
-            json.dump(self._data, fd, ensure_ascii=False, indent=2)
+            fd.write(payload)
             fd.flush()
             os.fsync(fd.fileno())
             fd.close()
-            os.replace(tmp_path, str(self._path))
+            os.replace(tmp_path, str(path))
+            return True
         except Exception:
             print(f"[{datetime.now().isoformat()}] flush failed")
             if tmp_path is not None:
@@ -313,22 +794,35 @@ class JsonStore:
                     os.unlink(tmp_path)
                 except Exception:
                     pass
+            return False
 
     def get_user_session(self, open_id: str) -> str | None:
-        with self._lock:
-            return self._data["user_sessions"].get(open_id)
+        return self._data["user_sessions"].get(open_id)
 
     def set_user_session(self, open_id: str, session_id: str) -> None:
-        with self._lock:
-            self._data["user_sessions"][open_id] = session_id
-            self._flush()
+        with self._rwlock.write():
+            self._mutate(
+                {"op": "user_session", "open_id": open_id, "session_id": session_id}
+            )
+        if self._sync:
+            self.flush()
 
     def get_all_user_sessions(self) -> dict[str, str]:
-        with self._lock:
-            return dict(self._data["user_sessions"])
+        return dict(self._data["user_sessions"])
+
+    def get_session_owner(self, session_id: str) -> str | None:
+        """The user a session belongs to, current or historical."""
+        return self._data["session_owners"].get(session_id)
+
+    def get_session_owners(self) -> dict[str, str]:
+        with self._rwlock.read():
+            return dict(self._data["session_owners"])
 
     def get_summary(self, session_id: str) -> dict[str, Any] | None:
-        with self._lock:
+        bucket = self._session_shard.get(session_id)
+        if bucket is not None:
+            self._ensure_shards((bucket,))
+        with self._rwlock.read():
             s = self._data["summaries"].get(session_id)
             return dict(s) if s is not None else None
 
@@ -339,12 +833,16 @@ class JsonStore:
         summary: str,
         keywords: list[str],
         user_id: str,
+        cursor: dict[str, Any] | None = None,
     ) -> None:
-        with self._lock:
+        with self._rwlock.write():
+            bucket = self._session_shard.get(session_id)
+            if bucket is not None:
+                self._load_shard(bucket)
             now = datetime.now().isoformat()
             existing = self._data["summaries"].get(session_id)
             created_at = existing["created_at"] if existing else now
-            self._data["summaries"][session_id] = {
+            value = {
                 "title": title,
                 "summary": summary,
                 "keywords": keywords,
@@ -352,84 +850,195 @@ class JsonStore:
                 "created_at": created_at,
                 "updated_at": now,
             }
-            idx = self._data["keyword_index"]
-            for kw, sids in list(idx.items()):
-                if session_id in sids:
-                    sids.remove(session_id)
-                    if not sids:
-                        del idx[kw]
-            for kw in keywords:
-                idx.setdefault(kw, [])
-                if session_id not in idx[kw]:
-                    idx[kw].append(session_id)
-            self._flush()
+            if cursor:
+                value["cursor"] = cursor
+            self._mutate({"op": "summary", "session_id": session_id, "value": value})
+        if self._sync:
+            self.flush()
+
+    def summary_version(self, user_id: str) -> int:
+        """Counter that changes whenever one of *user_id*'s summaries does."""
+        return self._versions.get(user_id, 0)
 
     def get_summarized_session_ids(self) -> set[str]:
-        with self._lock:
+        with self._rwlock.read():
+            if self._shards:
+                return set(self._session_shard)
             return set(self._data["summaries"].keys())
 
+    def get_summary_cursors(self) -> dict[str, dict[str, Any]]:
+        """Watermark of every summary: session_id -> cursor.
+
+        A cursor holds the session's ``updated`` time (ms) and the id of the
+        last message folded into the summary. Summaries written before
+        cursors existed fall back to their own ``updated_at``; pruned ones
+        keep the cursor they had when evicted.
+        """
+        if not self._cursors_complete:
+            self._ensure_shards(self._shards_for(None))
+            with self._rwlock.write():
+                self._cursors_complete = True
+                self._manifest_dirty = True
+        with self._rwlock.read():
+            cursors = dict(self._data["tombstones"])
+            cursors.update(self._data["cursors"])
+            return cursors
+
+    def prune(
+        self,
+        policy: RetentionPolicy,
+        orphaned_user_sessions: dict[str, str] | None = None,
+    ) -> dict[str, int]:
+        """Evict summaries outside *policy* and drop orphaned user sessions.
+
+        ``orphaned_user_sessions`` maps open_id -> session_id; an entry is
+        only removed if the user still points at that session. Returns the
+        number of evicted summaries and user sessions and the approximate
+        number of snapshot bytes reclaimed.
+        """
+        now = time.time()
+        self._ensure_shards(self._shards_for(None))
+        with self._rwlock.write():
+            summaries = self._data["summaries"]
+            victims: set[str] = set()
+            if policy.max_age_days:
+                cutoff = now - policy.max_age_days * 86400
+                victims.update(
+                    sid
+                    for sid, s in summaries.items()
+                    if _parse_ts(s.get("updated_at")) < cutoff
+                )
+            if policy.max_idle_days:
+                cutoff = now - policy.max_idle_days * 86400
+                victims.update(
+                    sid for sid in summaries if self._last_used(sid) < cutoff
+                )
+            if policy.max_per_user:
+                for sids in self._by_user.values():
+                    alive = [sid for sid in sids if sid not in victims]
+                    excess = len(alive) - policy.max_per_user
+                    if excess > 0:
+                        victims.update(
+                            heapq.nsmallest(excess, alive, key=self._last_used)
+                        )
+            reclaimed = sum(len(self._codec.encode(summaries[sid])) for sid in victims)
+            for sid in victims:
+                self._mutate({"op": "delete_summary", "session_id": sid})
+            removed_sessions = 0
+            for open_id, sid in (orphaned_user_sessions or {}).items():
+                if self._data["user_sessions"].get(open_id) == sid:
+                    self._mutate({"op": "delete_user_session", "open_id": open_id})
+                    removed_sessions += 1
+        return {
+            "summaries": len(victims),
+            "user_sessions": removed_sessions,
+            "bytes": reclaimed,
+        }
+
+    def keyword_idf(self, terms: list[str]) -> dict[str, float]:
+        """BM25 IDF of each term over the summaries' keyword lists."""
+        with self._rwlock.read():
+            n = len(self._data["summaries"])
+            if n == 0:
+                return {}
+            return {t: bm25_idf(self._index.df(t), n) for t in terms}
+
     def search_by_keywords(
-        self, keywords: list[str], user_id: str | None = None
+        self, keywords: list[str], user_id: str | None = None, limit: int = 10
     ) -> list[dict[str, Any]]:
-        with self._lock:
-            scores: dict[str, int] = {}
-            idx = self._data["keyword_index"]
-            for kw in keywords:
-                for sid in idx.get(kw, []):
-                    scores[sid] = scores.get(sid, 0) + 1
-            results: list[dict[str, Any]] = []
-            for sid, score in scores.items():
-                s = self._data["summaries"].get(sid)
-                if s is None:
+        """Rank summaries by BM25 over their text, plus an IDF bonus for
+        sessions explicitly tagged with a query keyword."""
+        self._ensure_shards(self._shards_for(user_id))
+        self._ensure_text_index()
+        with self._rwlock.read():
+            terms = [kw.lower() for kw in keywords if kw]
+            scores = self._text_index.score(terms, user_id)
+            n = len(self._data["summaries"])
+            for kw, qtf in Counter(terms).items():
+                sids = self._index.get(kw, user_id)
+                if not sids:
                     continue
-                if user_id is not None and s.get("user_id") != user_id:
-                    continue
-                entry = dict(s)
-                entry["session_id"] = sid
-                entry["_score"] = score
-                results.append(entry)
-            results.sort(
-                key=lambda x: (x["_score"], x.get("updated_at", "") or ""),
-                reverse=True,
-            )
-            for r in results[:10]:
-                r.pop("_score", None)
-            return results[:10]
+                bonus = bm25_idf(self._index.df(kw), n) * qtf
+                for sid in sids:
+                    scores[sid] = scores.get(sid, 0.0) + bonus
+            return self._top_results(scores, limit)
+
+    def search_semantic(
+        self, query: str, user_id: str | None = None, limit: int = 10
+    ) -> list[dict[str, Any]]:
+        """Rank summaries by cosine similarity of their embedding to *query*."""
+        self._ensure_shards(self._shards_for(user_id))
+        self._ensure_vector_index()
+        with self._rwlock.read():
+            return self._top_results(self._vectors.search(query, user_id, limit), limit)
 
     def search_by_text(
-        self, query: str, user_id: str | None = None
+        self, query: str, user_id: str | None = None, limit: int = 10
     ) -> list[dict[str, Any]]:
-        with self._lock:
+        terms = tokenize_text(query)
+        self._ensure_shards(self._shards_for(user_id))
+        if terms:
+            self._ensure_text_index()
+        with self._rwlock.read():
+            if terms:
+                return self._top_results(self._text_index.score(terms, user_id), limit)
+            # 查询中没有可索引的词（如纯标点、过短），退回子串匹配
             q = query.lower()
+            summaries = self._data["summaries"]
+            sids = summaries if user_id is None else self._by_user.get(user_id, ())
             results: list[dict[str, Any]] = []
-            for sid, s in self._data["summaries"].items():
-                if user_id is not None and s.get("user_id") != user_id:
-                    continue
-                haystack = " ".join(
-                    [
-                        s.get("title", ""),
-                        s.get("summary", ""),
-                        " ".join(s.get("keywords", [])),
-                    ]
-                ).lower()
-                if q in haystack:
+            for sid in sids:
+                s = summaries[sid]
+                if q in _summary_text(s).lower():
                     entry = dict(s)
                     entry["session_id"] = sid
                     results.append(entry)
-            results.sort(
-                key=lambda x: x.get("updated_at", "") or "",
-                reverse=True,
+            return heapq.nlargest(
+                limit, results, key=lambda x: x.get("updated_at", "") or ""
             )
-            return results[:10]
 
 
 class MemoryManager:
-    def __init__(self, store: JsonStore, client: Any, interval: float = 300.0) -> None:
+    def __init__(
+        self,
+        store: JsonStore,
+        client: Any,
+        interval: float = 300.0,
+        retention: RetentionPolicy | None = None,
+        prune_interval: float = 3600.0,
+        concurrency: int = 4,
+        session_timeout: float = 300.0,
+        retry_base: float = 60.0,
+        retry_max: float = 6 * 3600.0,
+        idle_delay: float = 60.0,
+        summarizer: Summarizer | None = None,
+        use_api_summary: bool = True,
+        is_session_active: Callable[[str], bool] | None = None,
+    ) -> None:
         self._store = store
         self._client = client
+        # 会话是否有在处理或排队中的 prompt；有则不能总结（API 总结会压缩会话）
+        self._is_session_active = is_session_active or (lambda _sid: False)
+        self._summarizer = summarizer or ExtractiveSummarizer(tokenize_text)
+        self._use_api_summary = use_api_summary
         self._interval = interval
+        self._retention = retention
+        self._prune_interval = prune_interval
+        self._last_prune = 0.0
+        self._concurrency = max(1, concurrency)
+        self._session_timeout = session_timeout
+        self._retry_base = retry_base
+        self._retry_max = retry_max
+        self._idle_delay = idle_delay
+        self._idle_timers: dict[str, threading.Timer] = {}
         self._running = False
         self._timer: threading.Timer | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+        # 正在总结的会话，避免定时与手动触发的扫描重复处理
+        self._in_flight: set[str] = set()
+        # 失败的会话: session_id -> (连续失败次数, 下次可重试时间)
+        self._failures: dict[str, tuple[int, float]] = {}
 
     def start(self) -> None:
         self._running = True
@@ -440,24 +1049,83 @@ class MemoryManager:
         if self._timer is not None:
             self._timer.cancel()
             self._timer = None
+        with self._lock:
+            executor, self._executor = self._executor, None
+            timers, self._idle_timers = self._idle_timers, {}
+        for timer in timers.values():
+            timer.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
 
     def _schedule_next(self) -> None:
         self._timer = threading.Timer(self._interval, self._sweep)
         self._timer.daemon = True
         self._timer.start()
 
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._concurrency, thread_name_prefix="memory-summary"
+                )
+            return self._executor
+
+    def notify_idle(self, session_id: str) -> None:
+        """Summarize *session_id* once it has been idle for ``idle_delay``.
+
+        Another idle event within the delay (the user kept chatting)
+        restarts the countdown.
+        """
+        if not self._running:
+            return
+        timer = threading.Timer(self._idle_delay, self._on_idle, args=(session_id,))
+        timer.daemon = True
+        with self._lock:
+            old = self._idle_timers.pop(session_id, None)
+            self._idle_timers[session_id] = timer
+        if old is not None:
+            old.cancel()
+        timer.start()
+
+    def _on_idle(self, session_id: str) -> None:
+        with self._lock:
+            if self._idle_timers.get(session_id) is not threading.current_thread():
+                return
+            del self._idle_timers[session_id]
+            retry_at = self._failures.get(session_id, (0, 0.0))[1]
+        if retry_at > time.time() or self._is_session_active(session_id):
+            return
+        try:
+            session = self._client.get_session(session_id)
+            status = self._client.get_session_status().get(session_id, {})
+        except Exception as e:
+            print(f"[{datetime.now().isoformat()}] get_session failed: {e}")
+            return
+        if not self._client.is_feishu_session(session):
+            return
+        # 计时期间用户可能又发了消息：会话仍忙或最近有更新就不总结
+        if status.get("type") == "busy" or self._is_session_active(session_id):
+            return
+        updated = _session_updated(session)
+        if updated and time.time() - updated / 1000.0 < self._idle_delay:
+            return
+        existing = self._store.get_summary(session_id)
+        if existing is not None:
+            cursor = _summary_cursor(existing)
+            if _session_updated(session) <= float(cursor.get("updated") or 0):
+                return
+        self._summarize_all([session])
+
     def _sweep(self) -> None:
         try:
             print(f"[{datetime.now().isoformat()}] memory sweep started")
-            unsummarized = self._find_unsummarized()
+            sessions = self._list_sessions()
+            unsummarized = self._find_unsummarized(sessions or [])
             print(
                 f"[{datetime.now().isoformat()}] found {len(unsummarized)} unsummarized sessions"
             )
-            for session in unsummarized:
-                try:
-                    self._summarize_session(session)
-                except Exception as e:
-                    print(f"[{datetime.now().isoformat()}] summarize failed: {e}")
+            self._summarize_all(unsummarized)
+            self._maybe_prune(sessions)
             print(f"[{datetime.now().isoformat()}] memory sweep finished")
         except Exception as e:
             print(f"[{datetime.now().isoformat()}] sweep error: {e}")
@@ -465,57 +1133,193 @@ class MemoryManager:
             if self._running:
                 self._schedule_next()
 
-    def _find_unsummarized(self) -> list[dict[str, Any]]:
+    def _summarize_all(self, sessions: list[dict[str, Any]]) -> None:
+        with self._lock:
+            todo = [s for s in sessions if s.get("id", "") not in self._in_flight]
+            self._in_flight.update(s.get("id", "") for s in todo)
+        if not todo:
+            return
         try:
-            sessions = self._client.list_sessions()
+            executor = self._get_executor()
+            wait([executor.submit(self._summarize_one, s) for s in todo])
+        finally:
+            with self._lock:
+                self._in_flight.difference_update(s.get("id", "") for s in todo)
+
+    def _summarize_one(self, session: dict[str, Any]) -> None:
+        sid = session.get("id", "")
+        try:
+            ok = self._summarize_session(session)
+        except Exception as e:
+            print(f"[{datetime.now().isoformat()}] summarize failed for {sid}: {e}")
+            ok = False
+        with self._lock:
+            if ok:
+                self._failures.pop(sid, None)
+                return
+            attempts = self._failures.get(sid, (0, 0.0))[0] + 1
+            delay = min(self._retry_base * 2 ** (attempts - 1), self._retry_max)
+            self._failures[sid] = (attempts, time.time() + delay)
+        print(
+            f"[{datetime.now().isoformat()}] will retry {sid} in {delay:.0f}s "
+            f"(attempt {attempts})"
+        )
+
+    def _list_sessions(self) -> list[dict[str, Any]] | None:
+        try:
+            return self._client.list_sessions()
         except Exception as e:
             print(f"[{datetime.now().isoformat()}] list_sessions failed: {e}")
-            return []
-        summarized = self._store.get_summarized_session_ids()
+            return None
+
+    def _maybe_prune(self, sessions: list[dict[str, Any]] | None) -> None:
+        if self._retention is None or not hasattr(self._store, "prune"):
+            return
+        if time.time() - self._last_prune < self._prune_interval:
+            return
+        self._last_prune = time.time()
+        orphaned = self._find_orphaned_user_sessions(sessions) if sessions else {}
+        if not self._retention.enabled and not orphaned:
+            return
+        stats = self._store.prune(self._retention, orphaned)
+        print(
+            f"[{datetime.now().isoformat()}] memory prune: evicted "
+            f"{stats['summaries']} summaries, {stats['user_sessions']} user sessions, "
+            f"reclaimed {stats['bytes']} bytes"
+        )
+
+    def _find_orphaned_user_sessions(
+        self, sessions: list[dict[str, Any]]
+    ) -> dict[str, str]:
+        """User sessions whose OpenCode session no longer exists.
+
+        ``list_sessions`` only returns ``feishu-*`` sessions, so anything not
+        listed is confirmed with a direct lookup before it counts as gone.
+        """
+        live = {s.get("id", "") for s in sessions}
+        orphaned: dict[str, str] = {}
+        for open_id, sid in self._store.get_all_user_sessions().items():
+            if sid in live:
+                continue
+            try:
+                self._client.get_session(sid)
+            except Exception as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if status == 404:
+                    orphaned[open_id] = sid
+        return orphaned
+
+    def _find_unsummarized(
+        self, sessions: list[dict[str, Any]]
+    ) -> list[dict[str, Any]]:
+        """Sessions with activity past their summary watermark."""
+        cursors = self._store.get_summary_cursors()
         now = time.time()
+        with self._lock:
+            backoff = {
+                sid for sid, (_, retry_at) in self._failures.items() if retry_at > now
+            }
         results: list[dict[str, Any]] = []
         for s in sessions:
             sid = s.get("id", "")
-            if sid in summarized:
+            if sid in backoff or self._is_session_active(sid):
+                continue
+            updated = _session_updated(s)
+            cursor = cursors.get(sid)
+            if cursor is not None and updated <= float(cursor.get("updated") or 0):
+                continue
+            # 会话仍在进行中，等它安静下来再总结
+            if updated and now - updated / 1000.0 < 300:
                 continue
-            updated = s.get("time", {}).get("updated")
-            if updated is not None:
-                try:
-                    ts = float(updated) / 1000.0
-                    if now - ts < 300:
-                        continue
-                except (ValueError, TypeError):
-                    pass
             results.append(s)
         return results
 
-    def _summarize_session(self, session: dict[str, Any]) -> None:
+    def _summarize_session(self, session: dict[str, Any]) -> bool:
         sid = session.get("id", "")
         title = session.get("title", sid)
+        existing = self._store.get_summary(sid)
+        last_id = ((existing or {}).get("cursor") or {}).get("message_id")
+        if existing and last_id:
+            return self._summarize_incremental(session, existing, last_id)
 
-        summary = self._try_api_summary(sid)
+        summary = self._try_api_summary(sid) if self._use_api_summary else ""
 
         if not summary:
             summary = self._fallback_summary(sid)
 
         if not summary:
-            return
+            return False
 
         keywords = self._extract_keywords(summary, title)
-        user_sessions = self._store.get_all_user_sessions()
-        user_id = ""
-        for uid, s in user_sessions.items():
-            if s == sid:
-                user_id = uid
-                break
-        self._store.set_summary(sid, title, summary, keywords, user_id)
+        user_id = self._store.get_session_owner(sid) or ""
+        cursor = {
+            "updated": _session_updated(session),
+            "message_id": self._last_message_id(sid),
+        }
+        self._store.set_summary(sid, title, summary, keywords, user_id, cursor=cursor)
         print(f"[{datetime.now().isoformat()}] summarized session {sid}: {title}")
+        return True
+
+    def _summarize_incremental(
+        self, session: dict[str, Any], existing: dict[str, Any], last_id: str
+    ) -> bool:
+        """Fold messages newer than the watermark into the existing summary."""
+        sid = session.get("id", "")
+        title = session.get("title", sid)
+        messages = self._client.get_session_messages(sid, limit=_INCREMENTAL_LIMIT)
+        if not isinstance(messages, list):
+            return False
+        ids = [_message_id(m) for m in messages]
+        # 找不到水位线说明新消息已超出本次拉取的窗口，整窗都算新增
+        start = ids.index(last_id) + 1 if last_id in ids else 0
+        fresh = messages[start:]
+        cursor = {
+            "updated": _session_updated(session),
+            "message_id": next((i for i in reversed(ids) if i), last_id),
+        }
+        conversations = self._extract_text_from_messages(fresh)
+        summary = existing.get("summary", "")
+        if conversations:
+            summary = self._merge_summary(
+                summary, self._generate_summary(conversations)
+            )
+        self._store.set_summary(
+            sid,
+            title,
+            summary,
+            self._extract_keywords(summary, title),
+            existing.get("user_id") or self._store.get_session_owner(sid) or "",
+            cursor=cursor,
+        )
+        print(
+            f"[{datetime.now().isoformat()}] updated summary of {sid} with "
+            f"{len(fresh)} new messages"
+        )
+        return True
+
+    def _merge_summary(self, old: str, delta: str) -> str:
+        merged = f"{old}\n{delta}" if old else delta
+        if len(merged) <= _SUMMARY_MAX_CHARS:
+            return merged
+        # 保留开头（会话的起因）和最新进展，中间截断
+        head = _SUMMARY_MAX_CHARS // 3
+        tail = _SUMMARY_MAX_CHARS - head - 5
+        return merged[:head] + " ... " + merged[-tail:]
+
+    def _last_message_id(self, sid: str) -> str:
+        try:
+            messages = self._client.get_session_messages(sid, limit=1)
+        except Exception:
+            return ""
+        if not isinstance(messages, list) or not messages:
+            return ""
+        return _message_id(messages[-1])
 
     def _try_api_summary(self, sid: str) -> str:
         if not hasattr(self._client, "summarize_session"):
             return ""
         try:
-            self._client.summarize_session(sid)
+            self._client.summarize_session(sid, timeout=self._session_timeout)
         except Exception as e:
             print(f"[{datetime.now().isoformat()}] summarize API failed for {sid}: {e}")
             return ""
@@ -574,22 +1378,12 @@ class MemoryManager:
         return result
 
     def _generate_summary(self, conversations: list[tuple[str, str]]) -> str:
-        full = "\n".join(f"[{role}] {text}" for role, text in conversations)
-        if len(full) > 1000:
-            return full[:400] + " ... " + full[-400:]
-        return full
+        return self._summarizer.summarize(conversations)
 
     def _extract_keywords(self, text: str, title: str) -> list[str]:
-        combined = f"{title} {text}".lower()
-        tokens = re.findall(r"[\u4e00-\u9fff]|[a-zA-Z]{3,}", combined)
-        freq: dict[str, int] = {}
-        for t in tokens:
-            t_lower = t.lower()
-            if t_lower in CHINESE_STOPWORDS or t_lower in ENGLISH_STOPWORDS:
-                continue
-            freq[t_lower] = freq.get(t_lower, 0) + 1
-        ranked = sorted(freq.items(), key=lambda x: -x[1])
-        return [kw for kw, _ in ranked[:15]]
+        return extract_keywords(
+            f"{title} {text}", idf=getattr(self._store, "keyword_idf", None)
+        )
 
     def trigger_sweep(self) -> None:
         t = threading.Thread(target=self._sweep, daemon=True)
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from typing import Callable, Protocol
+
+# 中文句末标点直接切分；英文句号后需跟空白，避免切断版本号和文件名
+_SENTENCE_SPLIT = re.compile(r"(?<=[。！？；!?;])|(?<=\.)\s+|\n+")
+_MIN_SENTENCE_CHARS = 4
+
+
+class Summarizer(Protocol):
+    def summarize(self, conversations: list[tuple[str, str]]) -> str: ...
+
+
+def split_sentences(text: str) -> list[str]:
+    return [
+        s.strip()
+        for s in _SENTENCE_SPLIT.split(text)
+        if s and len(s.strip()) >= _MIN_SENTENCE_CHARS
+    ]
+
+
+class TruncatingSummarizer:
+    """The original behaviour: keep the head and tail of the transcript."""
+
+    def __init__(self, max_chars: int = 1000) -> None:
+        self._max_chars = max_chars
+
+    def summarize(self, conversations: list[tuple[str, str]]) -> str:
+        full = "\n".join(f"[{role}] {text}" for role, text in conversations)
+        if len(full) > self._max_chars:
+            keep = self._max_chars * 2 // 5
+            return full[:keep] + " ... " + full[-keep:]
+        return full
+
+
+class ExtractiveSummarizer:
+    """Pick the most informative sentences of a conversation, offline.
+
+    Sentences are scored by the TF-IDF weight of their terms, with every
+    sentence treated as a document, and normalized by length. The first
+    user sentence gets a bonus because it usually states the task. The
+    highest-scoring sentences that fit in ``max_chars`` are returned in
+    their original order.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Callable[[str], list[str]],
+        max_chars: int = 600,
+        first_bonus: float = 1.5,
+    ) -> None:
+        self._tokenize = tokenizer
+        self._max_chars = max_chars
+        self._first_bonus = first_bonus
+
+    def summarize(self, conversations: list[tuple[str, str]]) -> str:
+        sentences: list[tuple[str, str]] = []
+        for role, text in conversations:
+            sentences.extend((role, s) for s in split_sentences(text))
+        if not sentences:
+            # 对话太短切不出句子，原样保留
+            return TruncatingSummarizer(self._max_chars).summarize(conversations)
+        tokens = [self._tokenize(s) for _, s in sentences]
+        df: Counter[str] = Counter()
+        for toks in tokens:
+            df.update(set(toks))
+        n = len(sentences)
+        scores: list[float] = []
+        for toks in tokens:
+            if not toks:
+                scores.append(0.0)
+                continue
+            tf = Counter(toks)
+            weight = sum(c * math.log(1.0 + n / df[t]) for t, c in tf.items())
+            scores.append(weight / math.sqrt(len(toks)))
+        first_user = next((i for i, (r, _) in enumerate(sentences) if r == "user"), 0)
+        scores[first_user] *= self._first_bonus
+
+        chosen: list[int] = []
+        seen: set[str] = set()
+        used = 0
+        for i in sorted(range(n), key=lambda i: -scores[i]):
+            if scores[i] <= 0:
+                break
+            if sentences[i][1] in seen:
+                continue
+            cost = len(sentences[i][1]) + len(sentences[i][0]) + 3
+            if used + cost > self._max_chars:
+                continue
+            chosen.append(i)
+            seen.add(sentences[i][1])
+            used += cost
+        if not chosen:
+            role, text = sentences[first_user]
+            return f"[{role}] {text[: self._max_chars]}"
+        return "\n".join(
+            f"[{sentences[i][0]}] {sentences[i][1]}" for i in sorted(chosen)
+        )
+
+
+def get_summarizer(
+    name: str, tokenizer: Callable[[str], list[str]], max_chars: int = 600
+) -> Summarizer:
+    name = name.lower()
+    if name == "extractive":
+        return ExtractiveSummarizer(tokenizer, max_chars=max_chars)
+    if name == "truncate":
+        return TruncatingSummarizer()
+    raise ValueError(f"unknown summarizer: {name}")
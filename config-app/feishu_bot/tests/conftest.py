@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 包目录本身就是项目根目录，把其父目录加入路径以便 import feishu_bot
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import sys
+
+from feishu_bot import main as main_module
+
+
+def test_main_reads_env_settings_and_lets_flags_win(monkeypatch):
+    monkeypatch.setenv("FEISHU_APP_ID", "env-id")
+    monkeypatch.setenv("FEISHU_APP_SECRET", "env-secret")
+    monkeypatch.setenv("FEISHU_STORE_DURABILITY", "sync")
+    monkeypatch.setenv("FEISHU_MEMORY_RETRIEVAL", "hybrid")
+    monkeypatch.setenv("OPENCODE_MODEL", "env-model")
+    monkeypatch.setattr(
+        sys, "argv", ["feishu-bot", "--app-id", "cli-id", "--no-server"]
+    )
+    monkeypatch.setattr(main_module, "_kill_stale_bots", lambda: None)
+    seen = {}
+
+    class _Bot:
+        def __init__(self, config):
+            seen["config"] = config
+
+        def start(self):
+            pass
+
+        def stop(self):
+            pass
+
+    monkeypatch.setattr(main_module, "FeishuBot", _Bot)
+    main_module.main()
+
+    config = seen["config"]
+    assert config.app_id == "cli-id"
+    assert config.app_secret == "env-secret"
+    assert config.store_durability == "sync"
+    assert config.memory_retrieval == "hybrid"
+    assert config.model == "env-model"
+    assert config.use_server_mode is False
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import time
+
+from feishu_bot.opencode_client import OpenCodeClient
+from feishu_bot.store import JsonStore, MemoryManager
+
+
+class _FakeClient:
+    is_feishu_session = staticmethod(OpenCodeClient.is_feishu_session)
+
+    def __init__(self, updated_ago: float, busy: bool = False) -> None:
+        self.updated_ago = updated_ago
+        self.busy = busy
+        self.summarized: list[str] = []
+
+    def get_session(self, session_id: str) -> dict:
+        updated = (time.time() - self.updated_ago) * 1000.0
+        return {"id": session_id, "title": "feishu-u1", "time": {"updated": updated}}
+
+    def get_session_status(self) -> dict:
+        return {"s1": {"type": "busy"}} if self.busy else {}
+
+    def summarize_session(self, session_id: str, **_: object) -> bool:
+        self.summarized.append(session_id)
+        return True
+
+    def get_session_messages(self, session_id: str, limit: int = 10) -> list:
+        return [
+            {
+                "info": {"id": "m1", "role": "user"},
+                "parts": [{"type": "text", "text": "怎么部署 nginx 反向代理？"}],
+            }
+        ]
+
+
+def _run_idle(tmp_path, client, active: bool = False) -> None:
+    store = JsonStore(str(tmp_path / "store.json"))
+    manager = MemoryManager(
+        store, client, idle_delay=0.05, is_session_active=lambda _sid: active
+    )
+    manager.start()
+    manager.notify_idle("s1")
+    time.sleep(0.5)
+    manager.stop()
+    store.close()
+
+
+def test_idle_summary_runs_for_a_quiet_session(tmp_path):
+    client = _FakeClient(updated_ago=60)
+    _run_idle(tmp_path, client)
+    assert client.summarized == ["s1"]
+
+
+def test_idle_summary_skips_recently_updated_busy_or_pending_sessions(tmp_path):
+    recent = _FakeClient(updated_ago=0)
+    _run_idle(tmp_path / "a", recent)
+    busy = _FakeClient(updated_ago=60, busy=True)
+    _run_idle(tmp_path / "b", busy)
+    pending = _FakeClient(updated_ago=60)
+    _run_idle(tmp_path / "c", pending, active=True)
+    assert recent.summarized == busy.summarized == pending.summarized == []
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from feishu_bot.opencode_client import OpenCodeClient
+
+_TEXT = "部署完成，请查看 nginx 日志"
+
+
+class _EventHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        payload = json.dumps(
+            {
+                "payload": {
+                    "type": "message.part.updated",
+                    "properties": {"text": _TEXT},
+                }
+            },
+            ensure_ascii=False,
+        ).encode("utf-8")
+        self.send_response(200)
+        # 与 OpenCode 一致，不带 charset
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        self.wfile.write(b"id: 1\ndata: " + payload + b"\n\n")
+        self.wfile.flush()
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def test_subscribe_events_decodes_utf8():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _EventHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = OpenCodeClient(port=server.server_address[1])
+    received: list[str] = []
+    got = threading.Event()
+
+    def on_event(event: dict) -> None:
+        received.append(event["payload"]["properties"]["text"])
+        got.set()
+
+    try:
+        client.subscribe_events(on_event)
+        assert got.wait(5)
+    finally:
+        client.close()
+        server.shutdown()
+    assert received[0] == _TEXT
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import random
+import threading
+import time
+
+from feishu_bot import opencode_processor
+from feishu_bot.config import FeishuConfig
+from feishu_bot.opencode_processor import OpenCodeProcessor
+
+
+class _FakeClient:
+    def __init__(self) -> None:
+        self.created: list[str] = []
+        self.prompts: list[str] = []
+        self._lock = threading.Lock()
+
+    def health_check(self) -> bool:
+        time.sleep(random.uniform(0, 0.02))
+        return True
+
+    def create_session(self, title: str | None = None) -> dict:
+        time.sleep(random.uniform(0, 0.02))
+        with self._lock:
+            self.created.append(title or "")
+            return {"id": f"ses_{len(self.created)}"}
+
+    def prompt_async(self, session_id: str, text: str) -> bool:
+        with self._lock:
+            self.prompts.append(text)
+        return True
+
+    def get_all_session_status(self) -> dict:
+        return {}
+
+
+def test_messages_from_one_sender_reach_the_session_in_order():
+    for _ in range(5):
+        config = FeishuConfig(app_id="x", app_secret="y", use_server_mode=False)
+        processor = OpenCodeProcessor(config)
+        client = _FakeClient()
+        processor._client = client
+        for i in range(3):
+            processor.process_message_async(
+                f"m{i}", "ou_user", f"msg {i}", lambda *_: True
+            )
+        deadline = time.time() + 5
+        while not client.prompts and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        processor.stop()
+
+        assert len(client.created) == 1
+        # 第一条先发出，其余在 session 忙时排队
+        assert client.prompts == ["msg 0"]
+        assert [i.text for q in processor._queues.values() for i in q] == [
+            "msg 1",
+            "msg 2",
+        ]
+
+
+def test_queue_positions_are_sent_in_order_off_the_prompt_pool():
+    config = FeishuConfig(
+        app_id="x",
+        app_secret="y",
+        use_server_mode=False,
+        prompt_max_inflight=1,
+        prompt_max_per_user=0,
+    )
+    processor = OpenCodeProcessor(config)
+    processor._client = _FakeClient()
+    updates: dict[str, list[int]] = {}
+    threads: set[str] = set()
+
+    def on_queued(message_id: str, position: int) -> None:
+        time.sleep(random.uniform(0, 0.01))
+        threads.add(threading.current_thread().name)
+        updates.setdefault(message_id, []).append(position)
+
+    for i in range(6):
+        processor.process_message_async(
+            f"m{i}", f"ou_{i}", f"msg {i}", lambda *_: True, queued_callback=on_queued
+        )
+
+    async def release_all() -> None:
+        for i in range(5):
+            processor._release(f"ou_{i}")
+
+    time.sleep(0.1)
+    processor._submit(release_all()).result(5)
+    deadline = time.time() + 5
+    while updates.get("m5", [None])[-1] != 0 and time.time() < deadline:
+        time.sleep(0.01)
+    processor.stop()
+
+    assert "m0" not in updates
+    for i in range(1, 6):
+        # 位置只减不增，同一位置不重复发送，最后以放行结束
+        assert updates[f"m{i}"] == sorted(set(updates[f"m{i}"]), reverse=True)
+        assert updates[f"m{i}"][0] == i and updates[f"m{i}"][-1] == 0
+    assert all(name.startswith("feishu-card") for name in threads)
+
+
+def test_poller_waits_until_the_prompt_is_sent(monkeypatch):
+    monkeypatch.setattr(opencode_processor, "_POLL_INTERVAL", 0.05)
+    config = FeishuConfig(app_id="x", app_secret="y", use_server_mode=False)
+    processor = OpenCodeProcessor(config)
+    client = _FakeClient()
+    answer = ["PREVIOUS ANSWER"]
+
+    def prompt_async(session_id: str, text: str) -> bool:
+        answer[0] = "NEW ANSWER"
+        return True
+
+    client.prompt_async = prompt_async
+    client.get_session_messages = lambda session_id: [
+        {"info": {"role": "assistant"}, "parts": [{"type": "text", "text": answer[0]}]}
+    ]
+    processor._client = client
+    # 构建 prompt 较慢（如首次建索引），期间 session 仍处于上一轮的空闲状态
+    processor._build_prompt = lambda sender, text: time.sleep(0.4) or text
+    replies: list[str] = []
+    processor.process_message_async(
+        "m0", "ou_user", "hi", lambda _mid, text: replies.append(text) or True
+    )
+    deadline = time.time() + 5
+    while not replies and time.time() < deadline:
+        time.sleep(0.01)
+    processor.stop()
+
+    assert replies == ["NEW ANSWER"]
@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import threading
+
+from feishu_bot.sqlite_store import SqliteStore
+
+
+def _in_thread(fn):
+    result: dict = {}
+
+    def run() -> None:
+        try:
+            result["value"] = fn()
+        except Exception as exc:
+            result["error"] = exc
+
+    t = threading.Thread(target=run)
+    t.start()
+    t.join(timeout=10)
+    assert not t.is_alive(), "other thread blocked on the database"
+    if "error" in result:
+        raise result["error"]
+    return result.get("value")
+
+
+def test_set_summary_is_visible_and_unlocked_for_other_threads(tmp_path):
+    store = SqliteStore(str(tmp_path / "store.db"))
+    store.set_summary("s1", "部署", "部署 nginx 反向代理", ["nginx", "部署"], "u1")
+
+    hits = _in_thread(lambda: store.search_by_keywords(["nginx"], user_id="u1"))
+    assert [h["session_id"] for h in hits] == ["s1"]
+
+    _in_thread(lambda: store.set_user_session("u1", "s2"))
+    assert store.get_user_session("u1") == "s2"
+    store.close()
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import threading
+
+import pytest
+
+from feishu_bot import codec
+from feishu_bot.store import JsonStore, RetentionPolicy
+
+
+def test_msgpack_store_without_msgpack_fails_instead_of_resetting(
+    tmp_path, monkeypatch
+):
+    pytest.importorskip("msgpack")
+    path = tmp_path / "store.json"
+    store = JsonStore(str(path), journal=True, codec="msgpack")
+    store.set_summary("s1", "部署", "部署 nginx", ["nginx"], "u1")
+    store.close()
+    before = path.read_bytes()
+
+    monkeypatch.setattr(codec, "msgpack", None)
+    with pytest.raises(ImportError):
+        JsonStore(str(path), journal=True)
+    assert path.read_bytes() == before
+
+
+def test_unknown_snapshot_format_fails(tmp_path):
+    path = tmp_path / "store.json"
+    path.write_bytes(b"not a snapshot")
+    with pytest.raises(codec.SnapshotFormatError):
+        JsonStore(str(path), journal=True)
+    assert path.read_bytes() == b"not a snapshot"
+
+
+def test_close_without_changes_does_not_rewrite_snapshot(tmp_path):
+    path = tmp_path / "store.json"
+    store = JsonStore(str(path), journal=True)
+    store.set_user_session("u1", "s1")
+    store.close()
+    mtime = path.stat().st_mtime_ns
+
+    store = JsonStore(str(path), journal=True)
+    assert store.get_user_session("u1") == "s1"
+    store.close()
+    assert path.stat().st_mtime_ns == mtime
+
+
+def test_summary_cursors_come_from_manifest(tmp_path):
+    path = tmp_path / "store.json"
+    store = JsonStore(str(path), journal=False, shards=4)
+    for i in range(8):
+        store.set_summary(f"s{i}", "t", "摘要", [], f"u{i % 4}", {"updated": i})
+    # 每个用户只留一条，被淘汰的摘要留下墓碑
+    assert store.prune(RetentionPolicy(max_per_user=1))["summaries"] == 4
+    store.close()
+
+    store = JsonStore(str(path), journal=False, shards=4)
+    cursors = store.get_summary_cursors()
+    assert store._loaded_shards == set()
+    assert cursors == {f"s{i}": {"updated": i} for i in range(8)}
+    store.close()
+
+
+def test_snapshot_is_encoded_outside_the_lock(tmp_path):
+    store = JsonStore(str(tmp_path / "store.json"), journal=False)
+    encoding = threading.Event()
+    release = threading.Event()
+    encode = store._codec.encode
+
+    def slow_encode(obj):
+        encoding.set()
+        release.wait(5)
+        return encode(obj)
+
+    store._codec.encode = slow_encode
+    try:
+        store.set_summary("s1", "部署", "部署 nginx", ["nginx"], "u1")
+        assert encoding.wait(5)
+        # 编码进行中，写者和读者都不应被读锁挡住
+        writer = threading.Thread(target=store.set_user_session, args=("u2", "s2"))
+        writer.start()
+        writer.join(1)
+        assert not writer.is_alive()
+        assert store.get_summary("s1")["title"] == "部署"
+    finally:
+        release.set()
+        store._codec.encode = encode
+        store.close()
+
+
+def test_torn_journal_tail_is_truncated_before_appending(tmp_path):
+    path = tmp_path / "store.json"
+    wal = tmp_path / "store.json.wal"
+    # 崩溃时最后一条记录只写了一半
+    wal.write_text(
+        '{"op":"user_session","open_id":"u1","session_id":"s1"}\n'
+        '{"op":"user_session","open_id":"u2","sess',
+        encoding="utf-8",
+    )
+    store = JsonStore(str(path), journal=True, durability="sync")
+    assert store.get_user_session("u1") == "s1"
+    assert store.get_user_session("u2") is None
+    store.set_user_session("u3", "s3")
+
+    # 不关闭第一个实例，模拟再次崩溃后重启
+    reopened = JsonStore(str(path), journal=True)
+    try:
+        assert reopened.get_user_session("u3") == "s3"
+    finally:
+        reopened.close()
+        store.close()
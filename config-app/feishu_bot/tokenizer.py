@@ -0,0 +1,329 @@
+"""Tokenization shared by the memory store, its indexes and prompt building.
+
+Index-side and query-side tokenization must agree, so everything that
+turns text into index terms lives here.
+"""
+
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Callable
+
+CHINESE_STOPWORDS: set[str] = {
+    "的",
+    "了",
+    "是",
+    "在",
+    "我",
+    "有",
+    "和",
+    "就",
+    "不",
+    "人",
+    "都",
+    "一",
+    "这",
+    "中",
+    "大",
+    "为",
+    "上",
+    "个",
+    "国",
+    "到",
+    "说",
+    "们",
+    "以",
+    "会",
+    "着",
+    "来",
+    "对",
+    "要",
+    "也",
+    "能",
+    "下",
+    "过",
+    "子",
+    "地",
+    "多",
+    "后",
+    "然",
+    "于",
+    "心",
+    "学",
+    "么",
+    "之",
+    "用",
+    "发",
+    "天",
+    "如",
+    "出",
+    "把",
+    "好",
+    "没",
+    "成",
+    "只",
+    "事",
+    "那",
+    "还",
+    "被",
+    "做",
+    "可",
+    "她",
+    "吧",
+    "最",
+    "但",
+    "他",
+    "它",
+    "你",
+    "很",
+    "看",
+    "得",
+    "去",
+    "又",
+    "让",
+    "给",
+    "从",
+    "想",
+    "与",
+    "而",
+    "等",
+    "比",
+    "其",
+    "更",
+    "已",
+    "所",
+    "同",
+    "日",
+    "手",
+    "行",
+    "前",
+    "无",
+    "动",
+    "方",
+    "问",
+    "应",
+    "新",
+    "间",
+    "两",
+    "次",
+    "些",
+    "什",
+    "当",
+    "经",
+    "头",
+    "起",
+    "第",
+    "公",
+    "此",
+    "工",
+    "使",
+    "情",
+    "感",
+    "种",
+    "面",
+    "别",
+    "开",
+    "门",
+    "回",
+    "话",
+    "该",
+    "并",
+    "进",
+    "正",
+    "向",
+    "关",
+    "点",
+    "长",
+}
+
+ENGLISH_STOPWORDS: set[str] = {
+    "the",
+    "a",
+    "an",
+    "is",
+    "are",
+    "was",
+    "were",
+    "be",
+    "been",
+    "being",
+    "have",
+    "has",
+    "had",
+    "do",
+    "does",
+    "did",
+    "will",
+    "would",
+    "shall",
+    "should",
+    "may",
+    "might",
+    "can",
+    "could",
+    "must",
+    "need",
+    "dare",
+    "ought",
+    "used",
+    "to",
+    "of",
+    "in",
+    "for",
+    "on",
+    "with",
+    "at",
+    "by",
+    "from",
+    "as",
+    "into",
+    "through",
+    "during",
+    "before",
+    "after",
+    "above",
+    "below",
+    "between",
+    "out",
+    "off",
+    "over",
+    "under",
+    "again",
+    "further",
+    "then",
+    "once",
+    "here",
+    "there",
+    "when",
+    "where",
+    "why",
+    "how",
+    "all",
+    "both",
+    "each",
+    "few",
+    "more",
+    "most",
+    "other",
+    "some",
+    "such",
+    "no",
+    "nor",
+    "not",
+    "only",
+    "own",
+    "same",
+    "so",
+    "than",
+    "too",
+    "very",
+    "just",
+    "because",
+    "but",
+    "and",
+    "or",
+    "if",
+    "while",
+    "that",
+    "this",
+    "it",
+    "its",
+    "i",
+    "me",
+    "my",
+    "we",
+    "our",
+    "you",
+    "your",
+    "he",
+    "him",
+    "his",
+    "she",
+    "her",
+    "they",
+    "them",
+    "their",
+    "what",
+    "which",
+    "who",
+    "whom",
+}
+
+_TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff]+|[a-z0-9]{2,}")
+
+
+def _is_cjk(run: str) -> bool:
+    return "\u4e00" <= run[0] <= "\u9fff"
+
+
+def tokenize_text(text: str) -> list[str]:
+    """Tokenize text for the full-text index.
+
+    Chinese runs yield single characters (minus stopwords) plus overlapping
+    bigrams, so both single-character keywords and two-character words
+    match; latin words of two or more characters are kept whole.
+    """
+    tokens: list[str] = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if _is_cjk(run):
+            tokens.extend(ch for ch in run if ch not in CHINESE_STOPWORDS)
+            tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+        elif run not in ENGLISH_STOPWORDS:
+            tokens.append(run)
+    return tokens
+
+
+def keyword_terms(text: str) -> list[str]:
+    """Terms worth using as keywords or query terms.
+
+    Unlike :func:`tokenize_text` this drops single Chinese characters in
+    favour of bigrams (a lone character is kept only when it is a run on
+    its own), and skips bigrams touching a stopword character, so the
+    resulting terms hit short posting lists.
+    """
+    terms: list[str] = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if _is_cjk(run):
+            if len(run) == 1:
+                if run not in CHINESE_STOPWORDS:
+                    terms.append(run)
+                continue
+            terms.extend(
+                run[i : i + 2]
+                for i in range(len(run) - 1)
+                if run[i] not in CHINESE_STOPWORDS
+                and run[i + 1] not in CHINESE_STOPWORDS
+            )
+        elif run not in ENGLISH_STOPWORDS:
+            terms.append(run)
+    return terms
+
+
+@lru_cache(maxsize=1024)
+def query_terms(text: str) -> tuple[str, ...]:
+    """Cached, de-duplicated :func:`keyword_terms` for search queries."""
+    return tuple(dict.fromkeys(keyword_terms(text)))
+
+
+def extract_keywords(
+    text: str,
+    limit: int = 15,
+    idf: Callable[[list[str]], dict[str, float]] | None = None,
+) -> list[str]:
+    """Pick the *limit* most distinctive keyword terms of *text*.
+
+    Terms are ranked by ``(1 + log tf) * idf``. Without an *idf* source
+    (e.g. an empty store) this reduces to term frequency.
+    """
+    tf = Counter(keyword_terms(text))
+    if not tf:
+        return []
+    weights = idf(list(tf)) if idf is not None else {}
+    scores = {
+        term: (1.0 + math.log(count)) * weights.get(term, 1.0)
+        for term, count in tf.items()
+    }
+    return sorted(scores, key=lambda t: (-scores[t], t))[:limit]
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import heapq
+import math
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Any, Iterable, Protocol
+
+from .tokenizer import tokenize_text
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+
+class Embedder(Protocol):
+    name: str
+    dim: int
+
+    def embed(self, texts: list[str]) -> list[list[float]]: ...
+
+
+class HashingEmbedder:
+    """Feature-hashing embedder over the full-text tokens.
+
+    Every token is hashed into one of ``dim`` buckets with a hashed sign,
+    weighted by ``1 + log tf`` and the vector L2-normalized. It needs no
+    model, so it can run anywhere. Because CJK bigrams are included,
+    texts that share words still land close together.
+    """
+
+    def __init__(self, dim: int = 512) -> None:
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed_one(t) for t in texts]
+
+    def _embed_one(self, text: str) -> list[float]:
+        vec = [0.0] * self.dim
+        for token, count in Counter(tokenize_text(text)).items():
+            h = zlib.crc32(token.encode("utf-8"))
+            sign = 1.0 if h & 0x80000000 else -1.0
+            vec[h % self.dim] += sign * (1.0 + math.log(count))
+        norm = math.sqrt(sum(v * v for v in vec))
+        return [v / norm for v in vec] if norm else vec
+
+
+class SentenceTransformerEmbedder:
+    """Local CPU embedding model via ``sentence-transformers``."""
+
+    def __init__(self, model: str) -> None:
+        if SentenceTransformer is None:
+            raise ImportError(
+                "sentence-transformers is required for model embeddings. "
+                "Install with: pip install sentence-transformers"
+            )
+        self._model = SentenceTransformer(model, device="cpu")
+        self.dim = int(self._model.get_sentence_embedding_dimension())
+        self.name = f"st-{model}"
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        vectors = self._model.encode(texts, normalize_embeddings=True)
+        return [list(map(float, v)) for v in vectors]
+
+
+def get_embedder(
+    name: str = "hashing",
+) -> HashingEmbedder | SentenceTransformerEmbedder:
+    """``hashing`` (default) or the name of a sentence-transformers model."""
+    if name in ("", "hashing"):
+        return HashingEmbedder()
+    return SentenceTransformerEmbedder(name)
+
+
+class VectorIndex:
+    """Dense vectors for cosine-similarity search, partitioned by user.
+
+    With NumPy the vectors live in one float32 matrix and a query is a
+    single matrix-vector product. Rows are deleted by swapping in the last
+    row, so the matrix never has holes. Without NumPy the same operations
+    run over plain lists.
+    """
+
+    def __init__(self, embedder: Embedder) -> None:
+        self.embedder = embedder
+        self._ids: list[str] = []
+        self._row: dict[str, int] = {}
+        self._partition: list[str] = []
+        self._by_partition: dict[str, set[str]] = {}
+        self._stamp: list[str] = []
+        self._cap = 0
+        self._matrix: Any = (
+            np.zeros((0, embedder.dim), dtype=np.float32) if np is not None else []
+        )
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def ids(self) -> list[str]:
+        return list(self._ids)
+
+    def stamp(self, session_id: str) -> str | None:
+        row = self._row.get(session_id)
+        return self._stamp[row] if row is not None else None
+
+    def add_many(self, items: list[tuple[str, str, str, str]]) -> None:
+        """Add ``(session_id, text, partition, stamp)`` items in one batch."""
+        if not items:
+            return
+        vectors = self.embedder.embed([text for _, text, _, _ in items])
+        for (sid, _, partition, stamp), vec in zip(items, vectors):
+            self._put(sid, vec, partition, stamp)
+
+    def add(self, session_id: str, text: str, partition: str, stamp: str) -> None:
+        self.add_many([(session_id, text, partition, stamp)])
+
+    def _put(self, sid: str, vec: Any, partition: str, stamp: str) -> None:
+        row = self._row.get(sid)
+        if row is None:
+            row = len(self._ids)
+            self._ids.append(sid)
+            self._partition.append(partition)
+            self._stamp.append(stamp)
+            self._row[sid] = row
+            self._grow(row + 1)
+        else:
+            self._by_partition.get(self._partition[row], set()).discard(sid)
+            self._partition[row] = partition
+            self._stamp[row] = stamp
+        self._by_partition.setdefault(partition, set()).add(sid)
+        if np is not None:
+            self._matrix[row] = vec
+        else:
+            self._matrix[row] = list(vec)
+
+    def _grow(self, size: int) -> None:
+        if np is None:
+            self._matrix.extend([] for _ in range(size - len(self._matrix)))
+            return
+        if size <= self._cap:
+            return
+        # 容量按倍数增长，避免每次插入都复制整个矩阵
+        self._cap = max(size, self._cap * 2, 64)
+        grown = np.zeros((self._cap, self.embedder.dim), dtype=np.float32)
+        grown[: len(self._matrix)] = self._matrix[: len(self._matrix)]
+        self._matrix = grown
+
+    def remove(self, session_id: str) -> None:
+        row = self._row.pop(session_id, None)
+        if row is None:
+            return
+        self._by_partition.get(self._partition[row], set()).discard(session_id)
+        last = len(self._ids) - 1
+        if row != last:
+            moved = self._ids[last]
+            self._ids[row] = moved
+            self._partition[row] = self._partition[last]
+            self._stamp[row] = self._stamp[last]
+            self._matrix[row] = self._matrix[last]
+            self._row[moved] = row
+        self._ids.pop()
+        self._partition.pop()
+        self._stamp.pop()
+        if np is None:
+            self._matrix.pop()
+
+    def search(
+        self, query: str, partition: str | None = None, k: int = 10
+    ) -> dict[str, float]:
+        """Cosine similarity of the top *k* rows (vectors are unit length)."""
+        n = len(self._ids)
+        if n == 0:
+            return {}
+        q = self.embedder.embed([query])[0]
+        rows: Iterable[int] = range(n)
+        if partition is not None:
+            rows = [self._row[sid] for sid in self._by_partition.get(partition, ())]
+            if not rows:
+                return {}
+        if np is not None:
+            q = np.asarray(q, dtype=np.float32)
+            if partition is None:
+                idx = np.arange(n)
+                sims = self._matrix[:n] @ q
+            else:
+                idx = np.fromiter(rows, dtype=np.int64)
+                sims = self._matrix[idx] @ q
+            if len(idx) > k:
+                top = np.argpartition(-sims, k)[:k]
+            else:
+                top = np.arange(len(idx))
+            return {self._ids[int(idx[i])]: float(sims[i]) for i in top if sims[i] > 0}
+        scored = ((sum(a * b for a, b in zip(self._matrix[i], q)), i) for i in rows)
+        return {self._ids[i]: s for s, i in heapq.nlargest(k, scored) if s > 0}
+
+    def save(self, path: Path) -> None:
+        if np is None:
+            return
+        n = len(self._ids)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(
+            tmp,
+            embedder=np.array(self.embedder.name),
+            ids=np.array(self._ids, dtype=str),
+            partitions=np.array(self._partition, dtype=str),
+            stamps=np.array(self._stamp, dtype=str),
+            matrix=self._matrix[:n],
+        )
+        tmp.replace(path)
+
+    def load(self, path: Path) -> None:
+        """Load vectors saved by :meth:`save` if they used the same embedder."""
+        if np is None or not path.exists():
+            return
+        with np.load(path) as data:
+            if str(data["embedder"]) != self.embedder.name:
+                return
+            matrix = data["matrix"].astype(np.float32)
+            ids = [str(x) for x in data["ids"]]
+            partitions = [str(x) for x in data["partitions"]]
+            stamps = [str(x) for x in data["stamps"]]
+        self._ids = ids
+        self._partition = partitions
+        self._stamp = stamps
+        self._row = {sid: i for i, sid in enumerate(ids)}
+        self._by_partition = {}
+        for sid, partition in zip(ids, partitions):
+            self._by_partition.setdefault(partition, set()).add(sid)
+        self._matrix = matrix
+        self._cap = len(matrix)